@@ -1,27 +1,53 @@
 import streamlit as st
-import yt_dlp
 import os
-import json
+import time
 import pandas as pd
 
 # Import de tous nos modules
-from diarization import upload_to_pyannote, start_identification_job, start_diarization_job, wait_for_result
-from transcript import load_whisper_model, transcribe_segments
-from translate import translate_transcript
+from transcript import load_whisper_model, available_devices, WHISPER_SIZES, WHISPER_SERVER
+from translate import get_translation_cache
+from pipeline import start_analysis
 from voiceprint import render_add_voiceprint_ui
-from final_video import download_video, generate_subtitled_video 
+from identification import LOCAL_THRESHOLD, TOP_K, MAX_CANDIDATES, HUNGARIAN_AVAILABLE
+from final_video import download_video, generate_subtitled_video, BURN_CRF, BURN_PRESET, BURN_PRESETS
+from media_cache import cache_usage, lease, youtube_id
+from voice_store import load_index, index_mtime, migrate_json, STORE_DIR as VOICE_STORE_DIR, LEGACY_JSON_PATH
 
 st.set_page_config(page_title="Youtube-Auto-Subtitler", page_icon="🧠", layout="wide")
 
 # --- Configuration ---
-DB_PATH = "voice_database.json"
+DB_PATH = LEGACY_JSON_PATH  # ancien format, migré une fois vers VOICE_STORE_DIR
+# Répliques affichées par page : le coût d'un rerun ne dépend plus de la longueur du transcript
+PAGE_SIZE = 50
+EXPORT_COLUMNS = ["start", "end", "speaker", "text_translated", "text"]
+# Rafraîchissement de la zone de progression pendant une analyse (seul ce fragment est réexécuté)
+POLL_SECONDS = 0.5
+# Le scan du cache média (listdir + stat de chaque fichier) n'est refait qu'à cet intervalle
+CACHE_USAGE_TTL = 30
 
 # --- Fonctions Utilitaires ---
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _cached_index(store_dir, mtime):
+    """Index relu seulement quand son mtime change (ajout d'une voix) ; partagé en lecture seule."""
+    return load_index(store_dir)
+
+@st.cache_data(ttl=CACHE_USAGE_TTL, show_spinner=False)
+def _cache_usage():
+    return cache_usage()
+
+@st.cache_data(show_spinner=False)
+def _available_devices():
+    """Import de torch et sonde CUDA une seule fois par processus."""
+    return available_devices()
+
 def load_voice_database():
-    if not os.path.exists(DB_PATH): return {}
+    """Index des voix (nom, style, position de l'embedding) : les vecteurs ne sont pas lus ici."""
     try:
-        with open(DB_PATH, 'r', encoding='utf-8') as f: return json.load(f)
-    except: return {}
+        migrate_json(DB_PATH, VOICE_STORE_DIR)
+        return _cached_index(VOICE_STORE_DIR, index_mtime(VOICE_STORE_DIR))
+    except Exception as e:
+        print(f"Erreur chargement base vocale : {e}")
+        return {}
 
 def get_speaker_style(speaker_name, db):
     # Si c'est un SPEAKER_XX générique (mode Diarization)
@@ -39,23 +65,58 @@ def get_speaker_style(speaker_name, db):
         
     return {"avatar": "👤", "color": "grey"}
 
-def download_audio(youtube_url):
-    download_path = "downloads"
-    if not os.path.exists(download_path): os.makedirs(download_path)
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': f'{download_path}/%(id)s.%(ext)s',
-        'postprocessors': [{'key': 'FFmpegExtractAudio','preferredcodec': 'wav'}],
-        'quiet': True,
-    }
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(youtube_url, download=True)
-            title = info.get('title', 'Vidéo')
-            filename = ydl.prepare_filename(info)
-            final_filename = os.path.splitext(filename)[0] + ".wav"
-            return final_filename, title
-    except Exception as e: return None, str(e)
+def render_analysis_status(run):
+    """Affiche l'état des étapes d'une analyse en arrière-plan."""
+    icons = {"pending": "⏳", "running": "🔄", "done": "✅", "cached": "💾", "error": "❌"}
+    if run.error:
+        label, state = "Erreur pendant l'analyse", "error"
+    elif run.done:
+        label, state = "Analyse terminée avec succès !", "complete"
+    else:
+        label, state = f"Traitement en cours... ({int(time.time() - run.started)} s)", "running"
+
+    with st.status(label, state=state, expanded=not run.done):
+        for info in run.stages.values():
+            line = f"{icons[info['status']]} {info['label']}"
+            if info["message"]: line += f" — {info['message']}"
+            st.write(line)
+            if info["status"] == "running" and info["progress"]:
+                st.progress(min(info["progress"], 1.0))
+
+@st.fragment(run_every=POLL_SECONDS)
+def render_analysis_progress(run, voice_db):
+    """
+    Zone relue pendant l'analyse : état des étapes et répliques déjà traduites.
+    Seul ce fragment est réexécuté (pas la barre latérale ni le reste de la page) ;
+    la fin de l'analyse déclenche un rerun complet qui enregistre le résultat.
+    """
+    render_analysis_status(run)
+    if run.done: st.rerun()
+    # Les répliques déjà traduites s'affichent pendant que la suite est transcrite
+    partial = run.partial[:]
+    if partial:
+        st.caption(f"{len(partial)} répliques traduites, la suite arrive... (dernières {min(len(partial), PAGE_SIZE)})")
+        render_chat(transcript_frame(partial[-PAGE_SIZE:], voice_db))
+
+def transcript_frame(transcript, db):
+    """DataFrame d'affichage, calculé une fois par analyse : styles des locuteurs résolus d'avance."""
+    df = pd.DataFrame(transcript, columns=EXPORT_COLUMNS)
+    styles = {name: get_speaker_style(name, db) for name in df["speaker"].unique()}
+    df["avatar"] = df["speaker"].map(lambda name: styles[name].get("avatar", "👤"))
+    df["display_name"] = df["speaker"].map(lambda name: styles[name].get("display_name", name))
+    return df
+
+def transcript_csv(df):
+    return df[EXPORT_COLUMNS].to_csv(index=False).encode('utf-8')
+
+def render_chat(df, show_original=False):
+    """Une bulle de chat par ligne du DataFrame (à appeler sur une page, jamais sur tout le transcript)."""
+    for row in df.itertuples(index=False):
+        with st.chat_message(name=row.speaker, avatar=row.avatar):
+            st.markdown(f"**{row.display_name}**")
+            st.write(row.text_translated)
+            if show_original:
+                st.caption(row.text)
 
 # --- UI ---
 
@@ -68,7 +129,7 @@ with st.sidebar:
     api_key = st.text_input("Clé API Pyannote", type="password")
     
     # Ajout de voix
-    render_add_voiceprint_ui(DB_PATH, api_key)
+    render_add_voiceprint_ui(VOICE_STORE_DIR, api_key)
     st.divider()
 
     # Chargement dynamique de la DB
@@ -79,16 +140,62 @@ with st.sidebar:
         with st.expander("Voir les profils actifs"):
             for name, data in voice_db.items():
                 style = data.get("style", {"avatar": "👤"})
-                st.write(f"{style['avatar']} **{name}**")
+                tags = data.get("tags")
+                st.write(f"{style['avatar']} **{name}**" + (f" · {', '.join(tags)}" if tags else ""))
     else:
         st.warning("Aucune base de données trouvée.")
 
     st.divider()
     target_lang = st.selectbox("Langue de traduction", ["fr", "en", "es", "de", "it"], index=0)
+    spoken_lang = st.selectbox("Langue parlée", ["Auto", "en", "fr", "es", "de", "it", "pt", "nl", "ja", "zh"], index=0,
+                               help="Auto : détectée une seule fois sur le fichier.")
+    per_segment_language = st.checkbox("Détection par segment (vidéo multilingue)", value=False)
+
+    with st.expander("⚙️ Performance Traduction"):
+        translate_workers = st.number_input("Requêtes simultanées", min_value=1, max_value=16, value=4)
+        translate_rate = st.number_input("Débit max (requêtes/s)", min_value=0.5, max_value=50.0, value=5.0, step=0.5,
+                                         help="Limite partagée par toutes les sessions de l'application.")
+
+    with st.expander("⚙️ Identification"):
+        max_candidates = st.number_input("Voix candidates max (/v1/identify)", min_value=1, max_value=500, value=MAX_CANDIDATES,
+                                         help="Au-delà, les voix sont pré-sélectionnées (tags puis sonde de l'audio).")
+        roster_tags = st.text_input("Roster (tags prioritaires)", help="Séparés par des virgules ; la chaîne de la vidéo est ajoutée automatiquement.")
+        st.caption("Identification locale")
+        local_threshold = st.slider("Seuil de similarité (cosinus)", 0.0, 1.0, LOCAL_THRESHOLD, 0.05)
+        top_k = st.number_input("Candidats affichés par locuteur (top-k)", min_value=1, max_value=10, value=TOP_K)
+        unique_match = st.checkbox("Une personne par locuteur (affectation hongroise)" if HUNGARIAN_AVAILABLE
+                                   else "Une personne par locuteur (affectation gloutonne : SciPy absent)", value=True)
+
+    with st.expander("⚙️ Performance Whisper"):
+        cpu_count = os.cpu_count() or 1
+        whisper_size = st.selectbox("Modèle", WHISPER_SIZES, index=WHISPER_SIZES.index("base"))
+        whisper_device = st.selectbox("Device", _available_devices(), index=0)
+        whisper_quantize = st.checkbox("Quantification int8 (CPU)", value=False,
+                                       help="Quantification dynamique des couches Linear : small/medium à une vitesse proche de base sur CPU.")
+        whisper_workers = st.number_input("Processus de transcription", min_value=1, max_value=cpu_count, value=1,
+                                          help="> 1 : les segments sont répartis sur plusieurs processus, chacun avec son modèle.")
+        torch_threads = st.number_input("Threads torch par processus (0 = auto)", min_value=0, max_value=cpu_count, value=0,
+                                        help="Appliqué aux processus de transcription ; le processus Streamlit, partagé par les sessions, garde le réglage de torch.")
+        st.caption("Comparer les configurations (RTF) : `python app/benchmark.py models <audio>`")
+        if WHISPER_SERVER:
+            st.info(f"Serveur Whisper partagé : {WHISPER_SERVER}. Le modèle et les processus sont ceux du serveur.")
+
+    usage = _cache_usage()
+    st.caption(f"💾 Cache média : {usage['bytes'] / 1e9:.2f} / {usage['budget_bytes'] / 1e9:.1f} Go "
+               f"({usage['files']} fichiers, {usage['hits']} hits, {usage['evicted_files']} évincés)")
+
+    whisper_config = {
+        "model_size": whisper_size,
+        "device": whisper_device,
+        "threads": int(torch_threads) or None,
+        "quantize": whisper_quantize and whisper_device == "cpu",
+    }
 
 # --- ZONE PRINCIPALE ---
 
-col_main_1, col_main_2 = st.columns([3, 1])
+ANALYSIS_MODES = {"Identification (Nommée)": "identification", "Identification locale": "local", "Diarization (Anonyme)": "diarization"}
+
+col_main_1, col_main_2, col_main_3 = st.columns([3, 1, 1])
 with col_main_1:
     url = st.text_input("URL YouTube")
 
@@ -96,73 +203,82 @@ with col_main_2:
     # --- NOUVEAU SÉLECTEUR DE MODE ---
     mode_analyse = st.radio(
         "Mode IA :",
-        ["Identification (Nommée)", "Diarization (Anonyme)"],
+        list(ANALYSIS_MODES),
+        index=0,
+        help="Identification utilise la DB pour trouver les noms. Identification locale compare les voix à la DB sur la machine (la DB n'est pas envoyée). Diarization distingue juste les voix (Speaker 00, 01...)."
+    )
+
+with col_main_3:
+    mode_whisper = st.radio(
+        "Transcription :",
+        ["Fenêtres ~30 s", "Passe complète", "Par segment"],
         index=0,
-        help="Identification utilise la DB pour trouver les noms. Diarization distingue juste les voix (Speaker 00, 01...)."
+        help="Fenêtres ~30 s regroupe les tours de parole courts en une seule passe Whisper (bien plus rapide). Passe complète transcrit tout le fichier d'un coup puis aligne les mots sur les locuteurs. Par segment transcrit chaque tour isolément."
     )
 
+WHISPER_ENGINES = {"Fenêtres ~30 s": "packed", "Passe complète": "full", "Par segment": "segment"}
+
 # --- BLOC 1 : CALCUL (Lancer l'analyse) ---
-if st.button("Lancer l'analyse"):
+# L'analyse tourne sur un exécuteur d'arrière-plan (pipeline.py) : Whisper démarre pendant le job
+# Pyannote, et le script se contente de relire l'état à chaque rerun (l'UI n'est jamais bloquée).
+if st.button("Lancer l'analyse", disabled='analysis_run' in st.session_state):
     if not api_key or not url:
         st.error("Veuillez remplir les champs obligatoires (API Key & URL).")
         st.stop()
 
+    if ANALYSIS_MODES[mode_analyse] != "diarization" and not voice_db:
+        st.error("Erreur : Le mode Identification nécessite au moins une voix dans la base de données (ajout via la sidebar).")
+        st.stop()
+
     with st.spinner("Initialisation des modèles IA..."):
-        whisper_model = load_whisper_model()
+        whisper_model = load_whisper_model(whisper_config["model_size"], whisper_config["device"], whisper_config["quantize"])
 
-    status_box = st.status("Traitement en cours...", expanded=True)
+    st.session_state['analysis_run'] = start_analysis({
+        "api_key": api_key,
+        "url": url,
+        "mode": ANALYSIS_MODES[mode_analyse],
+        "voice_db": voice_db,
+        "max_candidates": int(max_candidates),
+        "roster_tags": [t.strip() for t in roster_tags.split(",") if t.strip()],
+        "local_threshold": float(local_threshold),
+        "top_k": int(top_k),
+        "unique_match": unique_match,
+        "whisper_model": whisper_model,
+        # Note : transcript.py gère déjà intelligemment le champ 'speaker' ou 'match'
+        "engine": WHISPER_ENGINES[mode_whisper],
+        "workers": int(whisper_workers),
+        "torch_threads": int(torch_threads) or None,
+        "language": None if spoken_lang == "Auto" else spoken_lang,
+        "per_segment_language": per_segment_language,
+        "model_config": getattr(whisper_model, "config", whisper_config),
+        "target_lang": target_lang,
+        "translation_cache": get_translation_cache(),
+        "translate_workers": int(translate_workers),
+        "translate_rate": float(translate_rate),
+    })
+    st.session_state['analysis_done'] = False
 
-    try:
-        # 1. Download
-        status_box.write("📥 1/4 Téléchargement de l'audio...")
-        file_path, title = download_audio(url)
-        if not file_path: st.stop()
-
-        # 2. Pyannote Processing (Identification OU Diarization)
-        status_box.write(f"👤 2/4 Analyse Pyannote ({mode_analyse})...")
-        media_name, err = upload_to_pyannote(api_key, file_path)
-        if err: st.error(err); st.stop()
-        
-        # Diarization ou Identification
-        if mode_analyse == "Identification (Nommée)":
-            # Mode identification
-            if not voice_db:
-                
-                st.error("Erreur : Le mode Identification nécessite au moins une voix dans la base de données (ajout via la sidebar).")
-                st.stop()
-            job_id, err = start_identification_job(api_key, media_name, voice_db)
-        else:
-            # Mode Diarization 
-            job_id, err = start_diarization_job(api_key, media_name)
-            
-        if err: st.error(err); st.stop()
-        
-        # Attente du résultat (la fonction wait_for_result gère les deux types de sortie)
-        pyannote_res = wait_for_result(api_key, job_id)
-        if "error" in pyannote_res: st.error(pyannote_res['error']); st.stop()
-            
-        segments = pyannote_res.get("segments", [])
-        if not segments: st.warning("Aucun segment vocal détecté."); st.stop()
+run = st.session_state.get('analysis_run')
+if run:
+    if not run.done:
+        render_analysis_progress(run, voice_db)
+        st.stop()
 
-        # 3. Whisper Transcription
-        status_box.write("📝 3/4 Transcription du texte...")
-        # Note : transcript.py gère déjà intelligemment le champ 'speaker' ou 'match'
-        transcript_en = transcribe_segments(file_path, segments, whisper_model)
-        
-        # 4. Traduction
-        status_box.write(f"🌍 4/4 Traduction ({target_lang})...")
-        final_transcript = translate_transcript(transcript_en, target_lang=target_lang)
-        
-        status_box.update(label="Analyse terminée avec succès !", state="complete")
-        
+    render_analysis_status(run)
+    del st.session_state['analysis_run']
+    if run.error:
+        st.error(run.error)
+    else:
         # --- SAUVEGARDE EN SESSION STATE ---
         st.session_state['analysis_done'] = True
-        st.session_state['final_transcript'] = final_transcript
-        st.session_state['video_title'] = title
-        st.session_state['video_url'] = url 
-        
-    except Exception as e:
-        st.error(f"Une erreur inattendue est survenue : {e}")
+        st.session_state['final_transcript'] = run.result['final_transcript']
+        # Affichage et export calculés une fois ici, pas à chaque rerun
+        st.session_state['transcript_df'] = transcript_frame(run.result['final_transcript'], voice_db)
+        st.session_state['transcript_csv'] = transcript_csv(st.session_state['transcript_df'])
+        st.session_state['video_title'] = run.result['title']
+        st.session_state['video_url'] = run.result['url']
+        st.session_state['target_lang'] = run.result['target_lang']
+        st.session_state['source_lang'] = run.result['language']
 
 
 # --- BLOC 2 : AFFICHAGE & VIDÉO (Persistant) ---
@@ -176,31 +292,25 @@ if st.session_state.get('analysis_done'):
     st.divider()
     st.subheader(title)
     
-    show_original = st.toggle("Voir texte original")
+    df = st.session_state['transcript_df']
+    view_col, page_col = st.columns([3, 1])
+    with view_col:
+        view = st.radio("Affichage", ["Chat", "Tableau"], horizontal=True, label_visibility="collapsed")
+        show_original = view == "Chat" and st.toggle("Voir texte original")
 
-    # Affichage du Chat
-    for entry in final_transcript:
-        speaker_name = entry['speaker']
-        
-        # Récupération du style (fonction mise à jour plus haut pour gérer SPEAKER_00)
-        style = get_speaker_style(speaker_name, voice_db)
-        avatar = style.get("avatar", "👤")
-        display_name = style.get("display_name", speaker_name) 
-        
-        with st.chat_message(name=speaker_name, avatar=avatar):
-            st.markdown(f"**{display_name}**")
-            st.write(entry['text_translated'])
-            if show_original:
-                st.caption(entry['text'])
+    if view == "Tableau":
+        # st.dataframe est virtualisé : seules les lignes visibles sont dessinées
+        st.dataframe(df[EXPORT_COLUMNS], hide_index=True, use_container_width=True)
+    else:
+        # Affichage du Chat, page par page
+        pages = max(1, -(-len(df) // PAGE_SIZE))
+        with page_col:
+            page = st.number_input(f"Page (sur {pages})", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+        render_chat(df.iloc[(page - 1) * PAGE_SIZE:page * PAGE_SIZE], show_original)
 
-    # Export CSV
-    if final_transcript:
-        df = pd.DataFrame(final_transcript)
-        # On s'assure que les colonnes existent
-        cols = ["start", "end", "speaker", "text_translated", "text"]
-        existing_cols = [c for c in cols if c in df.columns]
-        csv = df[existing_cols].to_csv(index=False).encode('utf-8')
-        st.download_button("⬇️ Télécharger CSV", csv, "transcript.csv", "text/csv")
+    # Export CSV (précalculé à la fin de l'analyse)
+    if len(df):
+        st.download_button("⬇️ Télécharger CSV", st.session_state['transcript_csv'], "transcript.csv", "text/csv")
 
     # --- SECTION VIDÉO ---
     st.divider()
@@ -214,21 +324,44 @@ if st.session_state.get('analysis_done'):
             index=0
         )
     
-    use_original = (lang_choice == "Langue Originale (Transcription)")
+    with col_v2:
+        video_mode = st.radio(
+            "Sous-titres :",
+            ["Pistes (sans réencodage)", "Incrustés dans l'image"],
+            index=0,
+            help="Pistes : traduction + original ajoutés comme pistes sélectionnables dans le lecteur, en quelques secondes. Incrustés : réencodage complet, lisible partout."
+        )
+
+        use_original = (lang_choice == "Langue Originale (Transcription)")
+        soft_subs = video_mode == "Pistes (sans réencodage)"
+        burn_options = {}
+        if not soft_subs:
+            with st.expander("⚙️ Rendu incrusté"):
+                burn_workers = st.number_input("Morceaux rendus en parallèle", min_value=1, max_value=os.cpu_count() or 1,
+                                               value=os.cpu_count() or 1,
+                                               help="La vidéo est découpée aux images clés, chaque morceau est rendu par son propre FFmpeg.")
+                burn_crf = st.slider("Qualité (CRF, plus bas = meilleur)", 16, 32, BURN_CRF)
+                burn_preset = st.selectbox("Preset x264", BURN_PRESETS, index=BURN_PRESETS.index(BURN_PRESET))
+                burn_options = {"workers": int(burn_workers), "crf": int(burn_crf), "preset": burn_preset}
     
     if st.button("Générer la vidéo sous-titrée (MP4)"):
-        with st.status("Montage vidéo en cours...", expanded=True) as vid_status:
+        # La source reste épinglée dans le cache média pendant le rendu
+        with st.status("Montage vidéo en cours...", expanded=True) as vid_status, lease(youtube_id(saved_url)):
             
-            vid_status.write("📥 Téléchargement de la source vidéo...")
+            vid_status.write("📥 Source vidéo (cache média partagé avec l'analyse)...")
             video_source_path = download_video(saved_url)
             
             if video_source_path:
-                vid_status.write(f"⚙️ Incrustation des sous-titres ({'Original' if use_original else 'Traduit'})...")
+                vid_status.write(f"⚙️ {'Ajout des pistes' if soft_subs else 'Incrustation des sous-titres'} ({'Original' if use_original else 'Traduit'})...")
                 
                 final_video_path = generate_subtitled_video(
                     video_source_path, 
                     final_transcript, 
-                    use_original_lang=use_original
+                    use_original_lang=use_original,
+                    mode="soft" if soft_subs else "burn",
+                    target_lang=st.session_state.get('target_lang', 'fr'),
+                    source_lang=st.session_state.get('source_lang'),
+                    **burn_options
                 )
                 
                 if final_video_path and os.path.exists(final_video_path):
@@ -236,6 +369,8 @@ if st.session_state.get('analysis_done'):
                     st.success("Vidéo générée !")
                     
                     st.video(final_video_path)
+                    if soft_subs:
+                        st.caption("Les pistes de sous-titres se choisissent dans le lecteur vidéo (VLC, QuickTime, lecteurs TV...).")
                     
                     with open(final_video_path, "rb") as v_file:
                         st.download_button(
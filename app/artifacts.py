@@ -0,0 +1,49 @@
+"""
+Points de reprise de l'analyse : chaque étape écrit son résultat sur disque, sous une clé
+(id vidéo + paramètres de l'étape + clé de l'étape précédente).
+
+    artifacts/<id vidéo>/<étape>.<clé>.json
+
+Changer un paramètre change la clé de l'étape et de toutes les suivantes : une relance reprend
+à la première étape absente ou invalidée, les précédentes sont relues telles quelles.
+"""
+import os
+import json
+import time
+import hashlib
+import uuid
+
+ARTIFACT_DIR = "artifacts"
+
+def artifact_key(*parts, **params):
+    """Empreinte courte et stable de la clé parente et des paramètres (ordre indifférent)."""
+    payload = json.dumps([parts, params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def secret_fingerprint(secret):
+    """Distingue les comptes (un media:// n'est visible que du compte qui l'a envoyé) sans stocker la clé."""
+    return hashlib.sha1((secret or "").encode('utf-8')).hexdigest()[:8]
+
+def _path(video_id, stage, key, root):
+    return os.path.join(root, video_id, f"{stage}.{key}.json")
+
+def load_artifact(video_id, stage, key, max_age=None, root=ARTIFACT_DIR):
+    """Données de l'étape, ou None si absente, illisible ou plus vieille que max_age secondes."""
+    try:
+        with open(_path(video_id, stage, key, root), 'r', encoding='utf-8') as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if max_age is not None and time.time() - record.get("saved_at", 0) > max_age:
+        return None
+    return record.get("data")
+
+def save_artifact(video_id, stage, key, data, root=ARTIFACT_DIR):
+    """Écriture atomique (fichier temporaire puis renommage) : un arrêt brutal ne laisse jamais d'étape à moitié écrite."""
+    path = _path(video_id, stage, key, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.part"  # unique : deux travaux peuvent écrire la même étape
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"saved_at": time.time(), "data": data}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return data
@@ -0,0 +1,145 @@
+import os
+import mmap
+import uuid
+import wave
+import subprocess
+import numpy as np
+
+# Format compact de l'upload Pyannote : Opus mono 16 kHz à 32 kb/s (profil voix), ~4x plus léger
+# que la piste AAC/Opus téléchargée (~128 kb/s). Whisper lit la piste téléchargée, pas ce fichier.
+COMPACT_SAMPLE_RATE = 16000
+COMPACT_BITRATE = "32k"
+COMPACT_EXT = ".16k.opus"
+
+def _touch(path):
+    """Fichier dérivé réutilisé : rafraîchit son mtime (le cache média évince au plus ancien)."""
+    try: os.utime(path)
+    except OSError: pass
+
+def compact_audio_path(src_path):
+    if src_path.endswith(COMPACT_EXT): return src_path
+    return os.path.splitext(src_path)[0] + COMPACT_EXT
+
+def _compact_command(src_path, dst_path):
+    return [
+        'ffmpeg', '-nostdin', '-v', 'error', '-i', src_path,
+        '-vn', '-ac', '1', '-ar', str(COMPACT_SAMPLE_RATE), '-c:a', 'libopus',
+        '-b:a', COMPACT_BITRATE, '-application', 'voip', '-f', 'ogg', '-y', dst_path
+    ]
+
+def make_compact_audio(src_path, dst_path=None):
+    """
+    Transcode src vers le format compact (si absent) et retourne son chemin.
+    Le fichier n'apparaît qu'une fois l'encodage complet (renommage atomique) : il est toujours
+    envoyé entier (les URL pré-signées refusent le transfert chunked) et reste réutilisable.
+    """
+    dst_path = dst_path or compact_audio_path(src_path)
+    if os.path.exists(dst_path):
+        _touch(dst_path)
+        return dst_path
+    tmp_path = f"{dst_path}.{uuid.uuid4().hex[:8]}.part"  # unique : deux analyses peuvent compacter la même source
+    process = subprocess.run(_compact_command(src_path, tmp_path), capture_output=True, text=True)
+    if process.returncode != 0:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise RuntimeError(f"Erreur FFMPEG : {process.stderr}")
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+def cut_audio(src, dst_path, start_sec, end_sec, http_headers=None):
+    """
+    Extrait [start_sec, end_sec] en WAV mono 16 kHz sans décoder le reste du fichier :
+    -ss avant -i = seek dans l'entrée (requêtes Range si src est une URL de flux).
+    """
+    command = ['ffmpeg', '-nostdin', '-v', 'error']
+    if http_headers:
+        command += ['-headers', "".join(f"{k}: {v}\r\n" for k, v in http_headers.items())]
+    command += [
+        '-ss', str(start_sec), '-t', str(max(end_sec - start_sec, 0)), '-i', src,
+        '-vn', '-ac', '1', '-ar', str(COMPACT_SAMPLE_RATE), '-y', dst_path
+    ]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Erreur FFMPEG : {process.stderr}")
+    return dst_path
+
+PCM_EXT = ".16k.f32"
+
+def pcm_path(src_path):
+    if src_path.endswith(PCM_EXT): return src_path
+    if src_path.endswith(COMPACT_EXT): return src_path[:-len(COMPACT_EXT)] + PCM_EXT
+    return os.path.splitext(src_path)[0] + PCM_EXT
+
+def convert_to_pcm(src_path, dst_path=None):
+    """
+    Convertit une fois src en PCM float32 mono 16 kHz brut (écrit en flux sur disque par FFmpeg,
+    jamais en mémoire). Réutilisé tel quel aux appels suivants.
+    """
+    dst_path = dst_path or pcm_path(src_path)
+    if os.path.exists(dst_path):
+        _touch(dst_path)
+        return dst_path
+    tmp_path = f"{dst_path}.{uuid.uuid4().hex[:8]}.part"
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-i', src_path,
+               '-vn', '-ac', '1', '-ar', str(COMPACT_SAMPLE_RATE), '-f', 'f32le', '-y', tmp_path]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise RuntimeError(f"Erreur FFMPEG : {process.stderr}")
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+class AudioReader:
+    """
+    Audio float32 mono 16 kHz projeté en mémoire (copie privée, équivalent np.memmap mode='c').
+    Une tranche audio[a:b] est copiée puis ses pages sont rendues au noyau : la mémoire résidente
+    ne dépend que de la taille des tranches, pas de la durée du fichier.
+    Ouvrable depuis n'importe quel processus via son chemin (.16k.f32).
+    """
+
+    def __init__(self, src_path):
+        self.path = convert_to_pcm(src_path)
+        self._file = open(self.path, 'rb')
+        size = os.path.getsize(self.path) // 4
+        self._mmap = mmap.mmap(self._file.fileno(), size * 4, access=mmap.ACCESS_COPY) if size else None
+        self.samples = np.frombuffer(self._mmap, dtype=np.float32, count=size) if size else np.zeros(0, np.float32)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return len(self.samples) / COMPACT_SAMPLE_RATE
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice): return self.samples[key]
+        start, stop, step = key.indices(len(self.samples))
+        chunk = np.array(self.samples[start:stop:step])
+        self._release(start * 4, stop * 4)
+        return chunk
+
+    def read(self, start_sec, end_sec):
+        return self[int(start_sec * COMPACT_SAMPLE_RATE):int(end_sec * COMPACT_SAMPLE_RATE)]
+
+    def _release(self, begin, end):
+        # Pages non modifiées : les abandonner est sans perte, elles seront relues du fichier si besoin
+        if self._mmap is None or not hasattr(mmap, "MADV_DONTNEED"): return
+        begin -= begin % mmap.PAGESIZE
+        if end > begin: self._mmap.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+
+    def close(self):
+        self.samples = np.zeros(0, np.float32)
+        try:
+            if self._mmap is not None: self._mmap.close()
+        except BufferError:
+            pass  # une vue externe existe encore : la projection sera libérée avec elle
+        self._file.close()
+
+def write_wav(dst_path, samples, sample_rate=COMPACT_SAMPLE_RATE):
+    """Écrit un WAV PCM 16 bits mono à partir d'échantillons float32."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(dst_path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+    return dst_path
@@ -0,0 +1,270 @@
+"""
+Traitement par lots, sans Streamlit : file de travaux SQLite + worker.
+
+Usage :
+    python app/batch.py add urls.txt "https://www.youtube.com/playlist?list=..." --target-lang fr --subtitles soft
+    python app/batch.py run --jobs 4 --pyannote 4 --translation 2 --whisper-workers 2
+    python app/batch.py status
+    python app/batch.py retry
+
+Chaque travail écrit ses sorties dans <out>/<id vidéo>/ (transcript.json, transcript.csv, SRT, vidéo).
+Les étapes réseau (téléchargement, upload, Pyannote, traduction) et calcul (transcription, rendu)
+ont chacune leur limite de concurrence ; un arrêt du worker remet les travaux en cours en file au
+redémarrage, et les points de reprise (artifacts/) évitent de refaire les étapes terminées.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+import yt_dlp
+
+from job_queue import JobQueue, QUEUE_PATH
+from pipeline import AnalysisRun, run_analysis
+from progress import LogReporter
+from transcript import build_whisper_model, RemoteWhisper, WHISPER_SIZES
+from translate import TranslationCache, CACHE_PATH
+from final_video import generate_srt_file, generate_subtitled_video
+from media_cache import get_video, youtube_id, lease
+from voice_store import load_index, migrate_json, LEGACY_JSON_PATH
+
+OUTPUT_DIR = "batch_output"
+POLL_INTERVAL = 10
+# Limites par défaut : réseau (attente) généreux, calcul (CPU) restreint
+STAGE_LIMITS = {"download": 2, "upload": 2, "pyannote": 4, "transcript": 1, "translation": 2, "render": 1}
+
+_PLAYLIST = re.compile(r'list=|/playlist|/@|/channel/|/c/|/user/')
+# Lien vers une vidéo précise (watch?v=…&list=… compris) : jamais développé en playlist
+_VIDEO = re.compile(r'[?&]v=|youtu\.be/|/shorts/[\w-]{11}')
+# Chaîne -> onglets -> vidéos : deux niveaux suffisent, la limite évite de suivre des liens sans fin
+MAX_EXPAND_DEPTH = 2
+
+def _video_urls(entries, depth):
+    """URLs des vidéos d'une liste d'entrées à plat ; les onglets de chaîne et sous-playlists sont parcourus."""
+    urls = []
+    for entry in entries:
+        if not entry: continue
+        if entry.get('entries') is not None:
+            urls.extend(_video_urls(entry['entries'], depth))
+        elif entry.get('ie_key') == 'Youtube' and entry.get('id'):
+            urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
+        elif entry.get('url') and depth < MAX_EXPAND_DEPTH:
+            # Onglet de chaîne (Vidéos, Shorts, Live...) ou playlist : `ie_key` YoutubeTab, pas un id de vidéo
+            urls.extend(_extract_videos(entry['url'], depth + 1))
+    return urls
+
+def _extract_videos(url, depth=0):
+    with yt_dlp.YoutubeDL({'quiet': True, 'extract_flat': 'in_playlist'}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    return _video_urls(info.get('entries') or [], depth)
+
+def expand_url(url):
+    """
+    Une playlist ou une chaîne devient la liste de ses vidéos (métadonnées seulement, rien n'est téléchargé).
+    Une URL de vidéo reste une vidéo, même ouverte depuis une playlist (watch?v=…&list=…).
+    """
+    if _VIDEO.search(url) or not _PLAYLIST.search(url): return [url]
+    return _extract_videos(url) or [url]
+
+def read_inputs(inputs):
+    """Arguments = URLs ou fichiers texte (une URL par ligne, # pour commenter)."""
+    urls = []
+    for item in inputs:
+        if os.path.isfile(item):
+            with open(item, 'r', encoding='utf-8') as f:
+                lines = [line.strip() for line in f]
+            candidates = [line for line in lines if line and not line.startswith('#')]
+        else:
+            candidates = [item]
+        for url in candidates:
+            urls.extend(expand_url(url))
+    return list(dict.fromkeys(urls))
+
+class JobRun(AnalysisRun):
+    """État d'analyse d'un travail : journal préfixé + statut persistant dans la file."""
+
+    def __init__(self, queue, job_id):
+        super().__init__()
+        self.queue = queue
+        self.job_id = job_id
+        self.log = LogReporter(prefix=f"[job {job_id}] ")
+
+    def set(self, stage, status=None, progress=None, message=None):
+        super().set(stage, status, progress, message)
+        if status:
+            self.queue.update(self.job_id, stage=stage, message=message or status)
+            self.log.update(None, f"{stage} : {status}" + (f" ({message})" if message else ""))
+        elif progress is not None or message:
+            self.log.update(progress, f"{stage} : {message or ''}")
+
+def write_outputs(job_dir, transcript, options, shared, reporter):
+    """Transcript JSON/CSV, SRT traduit + original, puis vidéo sous-titrée si demandée."""
+    os.makedirs(job_dir, exist_ok=True)
+    with open(os.path.join(job_dir, "transcript.json"), 'w', encoding='utf-8') as f:
+        json.dump(transcript, f, ensure_ascii=False, indent=1)
+    df = pd.DataFrame(transcript)
+    cols = [c for c in ["start", "end", "speaker", "text_translated", "text"] if c in df.columns]
+    df[cols].to_csv(os.path.join(job_dir, "transcript.csv"), index=False)
+    generate_srt_file(transcript, os.path.join(job_dir, f"subtitles.{options['target_lang']}.srt"), 'text_translated')
+    generate_srt_file(transcript, os.path.join(job_dir, "subtitles.original.srt"), 'text')
+
+    if options["subtitles"] == "srt": return None
+    with shared["limits"]["render"], lease(youtube_id(options["url"])):
+        video_path, _, _ = get_video(options["url"])
+        rendered = generate_subtitled_video(
+            video_path, transcript, mode=options["subtitles"], target_lang=options["target_lang"],
+            source_lang=options.get("language"), workers=shared["burn_chunks"], progress_callback=reporter,
+            output_dir=job_dir)
+    if not rendered: raise RuntimeError("Échec de la génération vidéo.")
+    return rendered
+
+def process_job(queue, job, shared):
+    options = {**job["options"], "url": job["url"]}
+    run = JobRun(queue, job["id"])
+    # Un dossier par travail : la même vidéo peut être en file avec d'autres options (autre langue cible...)
+    job_dir = os.path.join(shared["out"], f"{youtube_id(job['url'])}-{job['id']}")
+    queue.update(job["id"], output_dir=job_dir)
+    try:
+        params = {
+            "api_key": shared["api_key"],
+            "url": job["url"],
+            "mode": options["mode"],
+            "voice_db": shared["voice_db"],
+            "whisper_model": shared["whisper_model"],
+            "engine": options["engine"],
+            "workers": shared["whisper_workers"],
+            "language": options.get("language"),
+            "model_config": shared["model_config"],
+            "target_lang": options["target_lang"],
+            "translation_cache": shared["translation_cache"],
+            "stage_limits": shared["limits"],
+        }
+        run_analysis(params, run)
+        if run.error: raise RuntimeError(run.error)
+
+        run.log.update(None, "écriture des sorties...")
+        # Langue détectée par Whisper si aucune n'était imposée (piste originale des sous-titres)
+        options["language"] = run.result["language"]
+        write_outputs(job_dir, run.result["final_transcript"], options, shared, run.log)
+        queue.update(job["id"], status="done", stage=None, message=f"{len(run.result['final_transcript'])} répliques")
+        run.log.update(None, f"terminé -> {job_dir}")
+    except Exception as e:
+        queue.update(job["id"], status="failed", error=str(e))
+        run.log.error(str(e))
+
+def run_worker(queue, args):
+    """Boucle du worker : jusqu'à --jobs travaux en cours, les étapes étant bornées par leurs sémaphores."""
+    if not args.api_key: raise SystemExit("Clé API Pyannote requise (--api-key ou PYANNOTE_API_KEY).")
+    requeued = queue.requeue("running")
+    if requeued: print(f"{requeued} travaux interrompus remis en file")
+    # Un worker lancé avant toute session Streamlit doit lui aussi voir les voix de l'ancienne base JSON
+    migrate_json(LEGACY_JSON_PATH)
+
+    if args.whisper_server:
+        # Serveur partagé : il ordonnance lui-même les fenêtres, --transcript peut alors dépasser 1
+        whisper_model = RemoteWhisper(args.whisper_server)
+        model_config = whisper_model.config
+        print(f"Serveur Whisper {args.whisper_server} ({model_config['model_size']})")
+    else:
+        model_config = {"model_size": args.whisper_size, "device": args.device, "threads": args.torch_threads,
+                        "quantize": args.quantize}
+        print(f"Chargement de Whisper ({args.whisper_size})...")
+        # Un seul modèle partagé : la transcription reste à 1 travail à la fois,
+        # le parallélisme CPU passe par --whisper-workers (processus)
+        whisper_model = build_whisper_model(**model_config)
+    shared = {
+        "api_key": args.api_key,
+        "out": args.out,
+        "voice_db": load_index(),
+        "model_config": model_config,
+        "whisper_model": whisper_model,
+        "whisper_workers": args.whisper_workers,
+        "translation_cache": TranslationCache(CACHE_PATH),
+        "burn_chunks": args.burn_chunks,
+        "limits": {stage: threading.Semaphore(getattr(args, stage)) for stage in STAGE_LIMITS},
+    }
+
+    active = set()
+    with ThreadPoolExecutor(max_workers=args.jobs, thread_name_prefix="job") as pool:
+        while True:
+            while len(active) < args.jobs:
+                job = queue.claim()
+                if not job: break
+                print(f"[job {job['id']}] démarrage : {job['url']}")
+                active.add(pool.submit(process_job, queue, job, shared))
+            if not active:
+                if not args.watch: break
+                time.sleep(POLL_INTERVAL)
+                continue
+            _, active = wait(active, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+    print("File vide :", queue.counts())
+
+def print_status(queue, status=None):
+    for job in queue.jobs(status):
+        line = f"{job['id']:>5}  {job['status']:<8} {job['url']}"
+        if job['status'] == "running" and job['stage']: line += f"  [{job['stage']}: {job['message'] or ''}]"
+        if job['status'] == "failed": line += f"  ! {job['error']}"
+        if job['status'] == "done": line += f"  -> {job['output_dir']}"
+        print(line)
+    print(queue.counts())
+
+def main():
+    parser = argparse.ArgumentParser(description="Traitement par lots Youtube-Auto-Subtitler")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="Fichier SQLite de la file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_add = sub.add_parser("add", help="Ajoute des URLs (ou fichiers d'URLs, playlists, chaînes)")
+    p_add.add_argument("inputs", nargs="+")
+    p_add.add_argument("--mode", choices=["diarization", "identification", "local"], default="diarization")
+    p_add.add_argument("--engine", choices=["packed", "full", "segment"], default="packed")
+    p_add.add_argument("--target-lang", default="fr")
+    p_add.add_argument("--language", default=None, help="Langue parlée (défaut : détectée)")
+    p_add.add_argument("--subtitles", choices=["srt", "soft", "burn"], default="soft",
+                       help="srt : fichiers seulement ; soft : pistes MP4 ; burn : incrustés")
+
+    p_run = sub.add_parser("run", help="Traite la file")
+    p_run.add_argument("--api-key", default=os.environ.get("PYANNOTE_API_KEY"))
+    p_run.add_argument("--out", default=OUTPUT_DIR)
+    p_run.add_argument("--jobs", type=int, default=4, help="Travaux menés de front")
+    for stage, default in STAGE_LIMITS.items():
+        p_run.add_argument(f"--{stage}", type=int, default=default, help=f"Concurrence de l'étape {stage}")
+    p_run.add_argument("--whisper-size", choices=WHISPER_SIZES, default="base")
+    p_run.add_argument("--device", default="cpu")
+    p_run.add_argument("--quantize", action="store_true")
+    p_run.add_argument("--torch-threads", type=int, default=None)
+    p_run.add_argument("--whisper-workers", type=int, default=1, help="Processus par transcription")
+    p_run.add_argument("--whisper-server", default=os.environ.get("WHISPER_SERVER"),
+                       help="hôte:port d'un serveur Whisper partagé (app/whisper_server.py) au lieu d'un modèle local")
+    p_run.add_argument("--burn-chunks", type=int, default=os.cpu_count() or 1, help="Morceaux rendus en parallèle (burn)")
+    p_run.add_argument("--watch", action="store_true", help="Attend de nouveaux travaux au lieu de s'arrêter")
+
+    p_status = sub.add_parser("status", help="État des travaux")
+    p_status.add_argument("--status", choices=["queued", "running", "done", "failed"], default=None)
+
+    sub.add_parser("retry", help="Remet en file les travaux en échec")
+
+    args = parser.parse_args()
+    queue = JobQueue(args.queue)
+
+    if args.command == "add":
+        options = {"mode": args.mode, "engine": args.engine, "target_lang": args.target_lang,
+                   "language": args.language, "subtitles": args.subtitles}
+        urls = read_inputs(args.inputs)
+        added = sum(1 for url in urls if queue.add(url, options))
+        print(f"{added} travaux ajoutés ({len(urls) - added} déjà en file)")
+
+    elif args.command == "run":
+        run_worker(queue, args)
+
+    elif args.command == "status":
+        print_status(queue, args.status)
+
+    elif args.command == "retry":
+        print(f"{queue.requeue('failed')} travaux remis en file")
+
+if __name__ == "__main__":
+    main()
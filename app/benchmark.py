@@ -0,0 +1,184 @@
+"""
+Mesures de performance hors Streamlit.
+
+Usage :
+    python app/benchmark.py language downloads/<id>.wav --segments 20 --duration 4
+    python app/benchmark.py models downloads/<id>.wav --sizes base small medium --quantize
+    python app/benchmark.py memory --hours 3
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import time
+import whisper
+from whisper.audio import SAMPLE_RATE
+
+from transcript import detect_language, build_whisper_model
+from audio_io import AudioReader
+
+def _time_segments(model, chunks, language):
+    start = time.perf_counter()
+    for chunk in chunks:
+        model.transcribe(chunk, fp16=False, language=language)
+    return (time.perf_counter() - start) / max(len(chunks), 1)
+
+def benchmark_language_detection(audio_path, model_name="base", n_segments=20, segment_sec=4.0):
+    """
+    Compare le temps moyen par segment : détection de langue par segment (ancien comportement)
+    contre langue détectée une fois puis passée en `language=`.
+    """
+    model = whisper.load_model(model_name)
+    audio = whisper.load_audio(audio_path)
+
+    seg_len = int(segment_sec * SAMPLE_RATE)
+    step = max((len(audio) - seg_len) // max(n_segments, 1), seg_len)
+    chunks = [audio[i:i + seg_len] for i in range(0, len(audio) - seg_len + 1, step)][:n_segments]
+
+    # Échauffement (allocation des poids, caches torch)
+    model.transcribe(chunks[0], fp16=False)
+
+    t0 = time.perf_counter()
+    language = detect_language(model, audio)
+    detect_once = time.perf_counter() - t0
+
+    per_segment = _time_segments(model, chunks, None)
+    fixed = _time_segments(model, chunks, language)
+
+    return {
+        "model": model_name,
+        "segments": len(chunks),
+        "language": language,
+        "detect_once_s": detect_once,
+        "per_segment_detection_s": per_segment,
+        "fixed_language_s": fixed,
+        "saved_per_segment_s": per_segment - fixed,
+    }
+
+def benchmark_model_configs(audio_path, configs, duration=60.0):
+    """
+    Latence et RTF (temps de calcul / durée audio) par configuration de modèle,
+    sur les `duration` premières secondes du fichier. RTF < 1 : plus rapide que le temps réel.
+    """
+    audio = whisper.load_audio(audio_path)[:int(duration * SAMPLE_RATE)]
+    audio_sec = len(audio) / SAMPLE_RATE
+
+    report = []
+    for config in configs:
+        t0 = time.perf_counter()
+        model = build_whisper_model(**config)
+        load_s = time.perf_counter() - t0
+
+        language = detect_language(model, audio)
+        t0 = time.perf_counter()
+        model.transcribe(audio, fp16=False, language=language)
+        elapsed = time.perf_counter() - t0
+
+        report.append({**config, "load_s": load_s, "transcribe_s": elapsed, "rtf": elapsed / audio_sec})
+        del model
+    return report
+
+def make_synthetic_audio(path, hours=3.0):
+    """Fichier de test long (bruit rose 16 kHz mono en FLAC), généré par FFmpeg sans passer par la mémoire."""
+    subprocess.run(['ffmpeg', '-nostdin', '-v', 'error', '-f', 'lavfi',
+                    '-i', f"anoisesrc=color=pink:amplitude=0.1:sample_rate={SAMPLE_RATE}:duration={hours * 3600}",
+                    '-ac', '1', '-c:a', 'flac', '-y', path], check=True)
+    return path
+
+def _peak_rss_mb():
+    # ru_maxrss est en Ko sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _scan(audio, window_sec):
+    """Lit tout le fichier par fenêtres, comme la boucle de transcription."""
+    step = int(window_sec * SAMPLE_RATE)
+    total = 0.0
+    for start in range(0, len(audio), step):
+        total += float(audio[start:start + step][:1].sum())
+    return total
+
+def _measure(loader, path, window_sec, queue):
+    t0 = time.perf_counter()
+    audio = whisper.load_audio(path) if loader == "decode" else AudioReader(path)
+    _scan(audio, window_sec)
+    queue.put((_peak_rss_mb(), time.perf_counter() - t0))
+
+def benchmark_memory(hours=3.0, window_sec=30.0, work_dir=None):
+    """
+    Pic de mémoire résidente pour parcourir un fichier synthétique de `hours` heures :
+    décodage complet en mémoire (whisper.load_audio, ancien comportement) contre AudioReader.
+    Chaque mesure tourne dans un processus neuf (ru_maxrss n'est jamais remis à zéro).
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="bench_audio_")
+    os.makedirs(work_dir, exist_ok=True)
+    source = make_synthetic_audio(os.path.join(work_dir, "synthetic.flac"), hours)
+    t0 = time.perf_counter()
+    AudioReader(source).close()  # conversion PCM unique, hors mesure
+    convert_s = time.perf_counter() - t0
+
+    ctx = multiprocessing.get_context("spawn")
+    report = {"hours": hours, "convert_s": convert_s}
+    for loader in ("decode", "reader"):
+        queue = ctx.Queue()
+        process = ctx.Process(target=_measure, args=(loader, source, window_sec, queue))
+        process.start()
+        report[loader] = queue.get()
+        process.join()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Youtube-Auto-Subtitler")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_lang = sub.add_parser("language", help="Gain de la détection de langue unique")
+    p_lang.add_argument("audio")
+    p_lang.add_argument("--model", default="base")
+    p_lang.add_argument("--segments", type=int, default=20)
+    p_lang.add_argument("--duration", type=float, default=4.0)
+
+    p_models = sub.add_parser("models", help="Latence / RTF par configuration Whisper")
+    p_models.add_argument("audio")
+    p_models.add_argument("--sizes", nargs="+", default=["base", "small"])
+    p_models.add_argument("--device", default="cpu")
+    p_models.add_argument("--threads", type=int, default=None)
+    p_models.add_argument("--quantize", action="store_true", help="Mesure aussi chaque taille en int8")
+    p_models.add_argument("--duration", type=float, default=60.0)
+
+    p_mem = sub.add_parser("memory", help="Pic de mémoire : décodage complet vs AudioReader")
+    p_mem.add_argument("--hours", type=float, default=3.0)
+    p_mem.add_argument("--window", type=float, default=30.0)
+    p_mem.add_argument("--work-dir", default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "language":
+        r = benchmark_language_detection(args.audio, args.model, args.segments, args.duration)
+        print(f"Modèle {r['model']} - {r['segments']} segments - langue détectée : {r['language']} ({r['detect_once_s']:.2f} s, une fois)")
+        print(f"Détection par segment : {r['per_segment_detection_s'] * 1000:.0f} ms/segment")
+        print(f"Langue fixée          : {r['fixed_language_s'] * 1000:.0f} ms/segment")
+        print(f"Gain                  : {r['saved_per_segment_s'] * 1000:.0f} ms/segment")
+
+    elif args.command == "models":
+        configs = []
+        for size in args.sizes:
+            configs.append({"model_size": size, "device": args.device, "threads": args.threads, "quantize": False})
+            if args.quantize and args.device == "cpu":
+                configs.append({"model_size": size, "device": args.device, "threads": args.threads, "quantize": True})
+
+        print(f"{'modèle':<10}{'device':<8}{'int8':<6}{'chargement':>12}{'transcription':>15}{'RTF':>8}")
+        for r in benchmark_model_configs(args.audio, configs, args.duration):
+            print(f"{r['model_size']:<10}{r['device']:<8}{'oui' if r['quantize'] else 'non':<6}"
+                  f"{r['load_s']:>11.1f}s{r['transcribe_s']:>14.1f}s{r['rtf']:>8.2f}")
+
+    elif args.command == "memory":
+        r = benchmark_memory(args.hours, args.window, args.work_dir)
+        print(f"Fichier synthétique de {r['hours']:.1f} h - conversion PCM unique : {r['convert_s']:.1f} s")
+        print(f"{'lecture':<22}{'pic RSS':>10}{'durée':>10}")
+        for loader, label in (("decode", "décodage complet"), ("reader", "AudioReader")):
+            rss, elapsed = r[loader]
+            print(f"{label:<22}{rss:>8.0f}Mo{elapsed:>9.1f}s")
+
+if __name__ == "__main__":
+    main()
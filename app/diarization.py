@@ -1,34 +1,37 @@
-import requests
 import uuid
-import time
 import os
-import json
+from pyannote_client import post_json, put_file, poll_job, JOB_DEADLINE
+from audio_io import make_compact_audio
+from voice_store import embedding_b64
 
-def upload_to_pyannote(api_key, file_path):
-    """(Inchangé) Envoie le fichier audio vers les serveurs de Pyannote."""
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    
+def request_upload_url(api_key, ext):
+    """Réserve un media:// chez Pyannote et récupère l'URL d'upload pré-signée."""
     safe_media_key = str(uuid.uuid4())
-    ext = os.path.splitext(file_path)[1]
-    if not ext: ext = ".wav"
     media_name = f"media://{safe_media_key}{ext}"
-    
-    # 1. Demande d'URL d'upload
+
     res_url = None
     try:
-        res_url = requests.post("https://api.pyannote.ai/v1/media/input", headers=headers, json={"url": media_name})
+        res_url = post_json(api_key, "/v1/media/input", {"url": media_name})
     except Exception as e:
-        return None, f"Erreur connexion: {str(e)}"
+        return None, None, f"Erreur connexion: {str(e)}"
 
     if not res_url or res_url.status_code not in [200, 201]:
-        return None, f"Erreur API Upload: {res_url.text if res_url else 'No response'}"
-    
-    upload_url = res_url.json()["url"]
-    
+        return None, None, f"Erreur API Upload: {res_url.text if res_url else 'No response'}"
+
+    return media_name, res_url.json()["url"], None
+
+def upload_to_pyannote(api_key, file_path):
+    """Envoie le fichier audio vers les serveurs de Pyannote (session partagée, timeouts, retries)."""
+    ext = os.path.splitext(file_path)[1]
+    if not ext: ext = ".wav"
+
+    # 1. Demande d'URL d'upload
+    media_name, upload_url, err = request_upload_url(api_key, ext)
+    if err: return None, err
+
     # 2. Upload binaire
     try:
-        with open(file_path, 'rb') as f:
-            res_upload = requests.put(upload_url, data=f)
+        res_upload = put_file(upload_url, file_path)
     except Exception as e:
         return None, f"Erreur envoi fichier: {str(e)}"
 
@@ -37,19 +40,49 @@ def upload_to_pyannote(api_key, file_path):
         
     return media_name, None
 
+def upload_compact_to_pyannote(api_key, file_path):
+    """
+    Upload en Opus mono 16 kHz plutôt que la piste téléchargée (`file_path`, ce qu'enverrait upload_to_pyannote).
+    Si le compact n'est pas plus léger (source déjà très compressée), la piste est envoyée telle quelle.
+    Le fichier est encodé en entier puis envoyé (les URL pré-signées refusent le transfert chunked).
+    audio_path : piste téléchargée, lue localement par Whisper (le compact, avec pertes, ne sert qu'à l'upload).
+    Retourne ({media_name, audio_path, original_bytes, uploaded_bytes}, erreur).
+    """
+    try:
+        upload_path = make_compact_audio(file_path)
+    except Exception as e:
+        return None, f"Erreur encodage audio: {str(e)}"
+    if os.path.getsize(upload_path) >= os.path.getsize(file_path): upload_path = file_path
+
+    media_name, upload_url, err = request_upload_url(api_key, os.path.splitext(upload_path)[1])
+    if err: return None, err
+
+    try:
+        res_upload = put_file(upload_url, upload_path)
+    except Exception as e:
+        return None, f"Erreur envoi fichier: {str(e)}"
+
+    if res_upload.status_code not in [200, 201]:
+        return None, f"Echec upload S3: {res_upload.text}"
+
+    return {
+        "media_name": media_name,
+        "audio_path": file_path,
+        "original_bytes": os.path.getsize(file_path),
+        "uploaded_bytes": os.path.getsize(upload_path),
+    }, None
+
 def start_identification_job(api_key, media_name, voice_db):
     """
     Lance le job d'IDENTIFICATION.
     Correction : Utilise 'label' et 'voiceprint' au lieu de 'id' et 'embedding'.
     """
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    
     # 1. Transformation de la base de données au format attendu par l'API
     voiceprints_list = []
     
     for speaker_name, data in voice_db.items():
-        # On vérifie si on a bien un embedding
-        raw_embedding = data.get("embedding")
+        # On vérifie si on a bien un embedding (ancien format JSON, sinon lu dans la base binaire)
+        raw_embedding = data.get("embedding") or (embedding_b64(data) if "offset" in data else None)
         
         if raw_embedding:
             # L'API refuse les labels commençant par "SPEAKER_"
@@ -75,10 +108,11 @@ def start_identification_job(api_key, media_name, voice_db):
     }
     
     # Debug : Afficher ce qu'on envoie (utile pour vérifier dans la console Streamlit)
-    print(f"Envoi de {len(voiceprints_list)} voiceprints à l'API.")
+    print(f"Envoi de {len(voiceprints_list)} voiceprints à l'API "
+          f"({sum(len(v['voiceprint']) for v in voiceprints_list) / 1024:.0f} Ko).")
     
     try:
-        res = requests.post("https://api.pyannote.ai/v1/identify", headers=headers, json=payload)
+        res = post_json(api_key, "/v1/identify", payload)
     except Exception as e:
         return None, f"Erreur connexion Job Start: {str(e)}"
 
@@ -93,11 +127,9 @@ def start_diarization_job(api_key, media_name):
     Lance une DIARIZATION simple (Qui parle quand ?).
     Ne nomme pas les gens, donne juste SPEAKER_00, SPEAKER_01...
     """
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    
     # Endpoint différent : /v1/diarize
     try:
-        res = requests.post("https://api.pyannote.ai/v1/diarize", headers=headers, json={"url": media_name, "exclusive": True})
+        res = post_json(api_key, "/v1/diarize", {"url": media_name, "exclusive": True})
     except Exception as e:
         return None, f"Erreur connexion Job Start: {str(e)}"
 
@@ -106,39 +138,27 @@ def start_diarization_job(api_key, media_name):
         
     return res.json()['jobId'], None
 
-def wait_for_result(api_key, job_id, progress_callback=None):
-    """Polling du résultat (Identification ou Diarisation)."""
-    headers = {"Authorization": f"Bearer {api_key}"}
-    
-    while True:
-        try:
-            res = requests.get(f"https://api.pyannote.ai/v1/jobs/{job_id}", headers=headers)
-        except requests.exceptions.ConnectionError:
-            time.sleep(1)
-            continue
-            
-        if res.status_code != 200: 
-            return {"error": f"Erreur Job Status: {res.text}"}
-            
-        job_info = res.json()
-        status = job_info['status']
-        
-        if status == 'succeeded':
-            if progress_callback: progress_callback(100)
-            
-            output = job_info['output']
-            
-            # Gestion spécifique du retour de l'identification
-            if 'identification' in output:
-                return {"status": "success", "segments": output['identification'], "type": "identification"}
-            
-            elif 'diarization' in output:
-                return {"status": "success", "segments": output['diarization'], "type": "diarization"}
-            else:
-                return {"status": "success", "raw": output} 
-                
-        elif status == 'failed': 
-            return {"error": "Le job Pyannote a échoué."}
-        
-        if progress_callback: progress_callback(50)
-        time.sleep(2)
\ No newline at end of file
+def wait_for_result(api_key, job_id, progress_callback=None, deadline=JOB_DEADLINE):
+    """Polling du résultat (Identification ou Diarisation), avec échéance globale (secondes)."""
+    job_info, err = poll_job(api_key, job_id, deadline=deadline,
+                             progress_callback=(lambda _: progress_callback(50)) if progress_callback else None)
+    if err:
+        return {"error": err}
+
+    status = job_info['status']
+
+    if status == 'succeeded':
+        if progress_callback: progress_callback(100)
+
+        output = job_info['output']
+
+        # Gestion spécifique du retour de l'identification
+        if 'identification' in output:
+            return {"status": "success", "segments": output['identification'], "type": "identification"}
+
+        elif 'diarization' in output:
+            return {"status": "success", "segments": output['diarization'], "type": "diarization"}
+        else:
+            return {"status": "success", "raw": output}
+
+    return {"error": "Le job Pyannote a échoué."}
\ No newline at end of file
@@ -1,25 +1,20 @@
-import streamlit as st
-import yt_dlp
 import os
 import subprocess
 import math
+import re
+import csv
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from media_cache import get_video
+from progress import get_reporter
 
 def download_video(youtube_url):
-    download_path = "downloads_video"
-    if not os.path.exists(download_path): os.makedirs(download_path)
-    ydl_opts = {
-        'format': 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-        'outtmpl': f'{download_path}/%(id)s.%(ext)s',
-        'quiet': True,
-    }
+    """Vidéo 720p via le cache média partagé (déjà présente si l'analyse a été faite)."""
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(youtube_url, download=True)
-            filename = ydl.prepare_filename(info)
-            if not os.path.exists(filename):
-                base = os.path.splitext(filename)[0]
-                if os.path.exists(base + ".mp4"): return base + ".mp4"
-            return filename
+        video_path, _, _ = get_video(youtube_url)
+        return video_path
     except Exception as e: return None
 
 def time_to_srt_format(seconds):
@@ -46,9 +41,11 @@ def split_text_into_chunks(text, max_chars=50):
     if current_chunk: chunks.append(" ".join(current_chunk))
     return chunks
 
-def generate_srt_file(transcript_data, srt_path, source_key='text_translated'):
+def generate_srt_file(transcript_data, srt_path, source_key='text_translated', window=None):
     """
     Génère le SRT en choisissant la bonne langue via source_key.
+    window=(début, fin) : seuls les sous-titres de cette plage sont écrits, recalés sur début (rendu par morceaux).
+    Retourne le nombre de sous-titres écrits.
     """
     srt_entries = []
     counter = 1
@@ -89,45 +86,190 @@ def generate_srt_file(transcript_data, srt_path, source_key='text_translated'):
             })
             counter += 1
 
+    if window:
+        win_start, win_end = window
+        sliced = []
+        for item in srt_entries:
+            if item['end'] <= win_start or item['start'] >= win_end: continue
+            sliced.append({"index": len(sliced) + 1, "text": item['text'],
+                           "start": max(item['start'], win_start) - win_start,
+                           "end": min(item['end'], win_end) - win_start})
+        srt_entries = sliced
+
     with open(srt_path, 'w', encoding='utf-8') as f:
         for item in srt_entries:
             f.write(f"{item['index']}\n")
             f.write(f"{time_to_srt_format(item['start'])} --> {time_to_srt_format(item['end'])}\n")
             f.write(f"{item['text']}\n\n")
+    return len(srt_entries)
+
+# Rendu incrusté : qualité/vitesse x264 réglables (l'ancien ultrafast produisait des fichiers énormes)
+BURN_CRF = 23
+BURN_PRESET = "veryfast"
+BURN_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow"]
+SUBTITLE_STYLE = "Fontname=Arial,Fontsize=18,PrimaryColour=&H00FFFFFF,BackColour=&H60000000,BorderStyle=3,Outline=1,Shadow=0,MarginV=25,Alignment=2"
+
+def _burn_command(src_name, srt_name, dst_name, crf=BURN_CRF, preset=BURN_PRESET, threads=0, audio=True):
+    """
+    Commande d'incrustation ; noms relatifs au cwd (le filtre subtitles gère mal les chemins).
+    srt_name=None : simple réencodage aux mêmes réglages (morceau sans dialogue, un SRT vide est refusé par le filtre).
+    audio=False : vidéo seule (morceaux du rendu parallèle, l'audio est remis d'un bloc à la fin).
+    """
+    subtitles = ['-vf', f"subtitles={srt_name}:force_style='{SUBTITLE_STYLE}'"] if srt_name else []
+    return [
+        'ffmpeg', '-nostdin', '-v', 'error', '-i', src_name, *subtitles,
+        *(['-c:a', 'copy'] if audio else ['-an']), '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+        '-threads', str(threads), '-y', dst_name
+    ]
+
+def media_duration(path):
+    """Durée (s) lue dans l'en-tête par FFmpeg, None si illisible."""
+    process = subprocess.run(['ffmpeg', '-nostdin', '-i', path], capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", process.stderr)
+    if not match: return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def _run(command, cwd):
+    process = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Erreur FFMPEG : {process.stderr}")
+
+def burn_parallel(video_path, transcript_data, output_path, source_key, workers, crf=BURN_CRF, preset=BURN_PRESET):
+    """
+    Incrustation répartie sur plusieurs cœurs :
+    1. découpe de la piste vidéo seule, sans réencodage, aux images clés (muxer segment, liste CSV des bornes réelles) ;
+    2. un SRT recalé par morceau, rendus par des FFmpeg concurrents ;
+    3. recollage par le démuxeur concat (copie de flux), puis l'audio d'origine est ajouté d'un seul tenant :
+       recoller des morceaux d'AAC laisserait des trous ou des clics aux jointures.
+    """
+    duration = media_duration(video_path)
+    if not duration: raise RuntimeError("Durée de la vidéo illisible.")
+    work_dir = tempfile.mkdtemp(prefix="burn_", dir=os.path.dirname(video_path) or ".")
+    try:
+        _run(['ffmpeg', '-nostdin', '-v', 'error', '-i', os.path.abspath(video_path), '-map', '0:v:0', '-c', 'copy',
+              '-f', 'segment', '-segment_time', f"{duration / workers:.3f}", '-reset_timestamps', '1',
+              '-segment_list', 'chunks.csv', '-segment_list_type', 'csv', 'chunk_%03d.mp4'], work_dir)
+
+        with open(os.path.join(work_dir, 'chunks.csv'), newline='') as f:
+            chunks = [(name, float(start), float(end)) for name, start, end in csv.reader(f)]
+
+        # Threads x264 partagés entre les rendus concurrents
+        threads = max(1, (os.cpu_count() or 1) // len(chunks))
+
+        def render(chunk):
+            name, start, end = chunk
+            stem = os.path.splitext(name)[0]
+            count = generate_srt_file(transcript_data, os.path.join(work_dir, f"{stem}.srt"), source_key, window=(start, end))
+            _run(_burn_command(name, f"{stem}.srt" if count else None, f"{stem}_sub.mp4", crf, preset, threads, audio=False),
+                 work_dir)
+            return f"{stem}_sub.mp4"
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rendered = list(pool.map(render, chunks))
+
+        with open(os.path.join(work_dir, 'concat.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(f"file '{name}'\n" for name in rendered)
+        _run(['ffmpeg', '-nostdin', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', 'concat.txt',
+              '-i', os.path.abspath(video_path), '-map', '0:v', '-map', '1:a?', '-c', 'copy',
+              '-movflags', '+faststart', '-y', os.path.abspath(output_path)], work_dir)
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Codes ISO 639-2 attendus par le conteneur MP4 pour les pistes de sous-titres
+ISO_639_2 = {"fr": "fra", "en": "eng", "es": "spa", "de": "deu", "it": "ita", "pt": "por", "nl": "nld", "ja": "jpn", "zh": "zho"}
+
+def _output_path(video_path, suffix, output_dir=None):
+    name = os.path.basename(video_path).replace(".mp4", suffix)
+    return os.path.join(output_dir or os.path.dirname(video_path), name)
+
+def _temp_srt_path(video_path, tag=""):
+    # Nom unique : deux rendus concurrents de la même vidéo (sessions, travaux batch) ne se marchent pas dessus
+    return video_path.replace(".mp4", f"{tag}.{uuid.uuid4().hex[:8]}.srt")
 
-def generate_subtitled_video(video_path, transcript_data, use_original_lang=False):
+def mux_soft_subtitles(video_path, transcript_data, tracks, progress_callback=None, output_dir=None):
+    """
+    Ajoute des pistes de sous-titres mov_text au MP4 sans réencodage (-c:v copy -c:a copy) : quelques secondes.
+    tracks : [(source_key, code langue, titre), ...] ; la première piste est celle affichée par défaut.
+    output_dir : dossier du résultat (défaut : celui de la vidéo).
+    """
+    reporter = get_reporter(progress_callback)
+    try:
+        video_dir = os.path.dirname(video_path)
+        output_path = _output_path(video_path, "_soft.mp4", output_dir)
+
+        srt_paths = []
+        command = ['ffmpeg', '-nostdin', '-v', 'error', '-i', os.path.basename(video_path)]
+        for source_key, _, _ in tracks:
+            srt_path = _temp_srt_path(video_path, f".{source_key}")
+            generate_srt_file(transcript_data, srt_path, source_key=source_key)
+            srt_paths.append(srt_path)
+            command += ['-i', os.path.basename(srt_path)]
+
+        command += ['-map', '0:v', '-map', '0:a?']
+        for i, (_, lang, title) in enumerate(tracks):
+            command += ['-map', str(i + 1),
+                        f'-metadata:s:s:{i}', f"language={ISO_639_2.get(lang, lang or 'und')}",
+                        f'-metadata:s:s:{i}', f"title={title}",
+                        f'-metadata:s:s:{i}', f"handler_name={title}",  # nom de piste lu par les lecteurs MP4
+                        f'-disposition:s:{i}', 'default' if i == 0 else '0']
+        command += ['-c:v', 'copy', '-c:a', 'copy', '-c:s', 'mov_text', '-movflags', '+faststart', '-y',
+                    os.path.abspath(output_path)]
+
+        process = subprocess.run(command, cwd=video_dir, capture_output=True, text=True)
+        for srt_path in srt_paths:
+            if os.path.exists(srt_path): os.remove(srt_path)
+        if process.returncode != 0:
+            reporter.error(f"Erreur FFMPEG : {process.stderr}")
+            return None
+        return output_path
+
+    except Exception as e:
+        reporter.error(f"Erreur ajout des pistes : {e}")
+        return None
+
+def generate_subtitled_video(video_path, transcript_data, use_original_lang=False, mode="burn", target_lang="fr", source_lang=None,
+                             workers=1, crf=BURN_CRF, preset=BURN_PRESET, progress_callback=None, output_dir=None):
     """
     Accepte un paramètre use_original_lang.
+    mode="soft" : pistes mov_text (traduction + original) sans réencodage ; "burn" : incrustation dans l'image.
+    workers > 1 : incrustation par morceaux rendus en parallèle.
+    progress_callback : ProgressReporter ou fonction (fraction, message) recevant les erreurs ; None = st.error.
+    output_dir : dossier du résultat (défaut : celui de la vidéo, dans le cache média).
     """
+    reporter = get_reporter(progress_callback)
+    if mode == "soft":
+        translated = ('text_translated', target_lang, f"Traduction ({target_lang})")
+        original = ('text', source_lang, "Original")
+        tracks = [original, translated] if use_original_lang else [translated, original]
+        return mux_soft_subtitles(video_path, transcript_data, tracks, reporter, output_dir)
+
     try:
         # Choix de la clé selon le paramètre
         key_to_use = 'text' if use_original_lang else 'text_translated'
         
-        srt_path = video_path.replace(".mp4", ".srt")
+        output_path = _output_path(video_path, "_subtitled.mp4", output_dir)
+        if workers > 1:
+            return burn_parallel(video_path, transcript_data, output_path, key_to_use, workers, crf, preset)
+
+        srt_path = _temp_srt_path(video_path)
         
         # On passe la clé à la fonction SRT
         generate_srt_file(transcript_data, srt_path, source_key=key_to_use)
         
-        output_path = video_path.replace(".mp4", "_subtitled.mp4")
         srt_filename = os.path.basename(srt_path)
         video_dir = os.path.dirname(video_path)
         
-        style = "Fontname=Arial,Fontsize=18,PrimaryColour=&H00FFFFFF,BackColour=&H60000000,BorderStyle=3,Outline=1,Shadow=0,MarginV=25,Alignment=2"
-        
-        command = [
-            'ffmpeg', '-i', os.path.basename(video_path),
-            '-vf', f"subtitles={srt_filename}:force_style='{style}'",
-            '-c:a', 'copy', '-c:v', 'libx264', '-preset', 'ultrafast', '-y',
-            os.path.basename(output_path)
-        ]
+        command = _burn_command(os.path.basename(video_path), srt_filename, os.path.abspath(output_path), crf, preset)
         
         process = subprocess.run(command, cwd=video_dir, capture_output=True, text=True)
+        if os.path.exists(srt_path): os.remove(srt_path)
         if process.returncode != 0:
-            st.error(f"Erreur FFMPEG : {process.stderr}")
+            reporter.error(f"Erreur FFMPEG : {process.stderr}")
             return None
-        if os.path.exists(srt_path): os.remove(srt_path)
-        return os.path.join(video_dir, os.path.basename(output_path))
+        return output_path
 
     except Exception as e:
-        st.error(f"Erreur incrustation : {e}")
+        reporter.error(f"Erreur incrustation : {e}")
         return None
@@ -0,0 +1,222 @@
+"""
+Identification locale : alternative à /v1/identify.
+
+Pyannote ne fait que la diarisation (/v1/diarize) ; pour chaque cluster SPEAKER_XX, un extrait
+de ses tours les plus longs est envoyé à /v1/voiceprint, puis les embeddings obtenus sont comparés
+à toute la base en une seule multiplication matricielle (similarité cosinus NumPy).
+La base n'est plus envoyée à l'API : la taille des requêtes ne dépend plus du nombre de voix.
+"""
+import os
+import base64
+import uuid
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # SciPy est dans requirements.txt ; sans lui, affectation gloutonne
+    linear_sum_assignment = None
+
+from audio_io import AudioReader, write_wav
+from media_cache import VOICEPRINT_DIR
+from voice_store import load_matrix, STORE_DIR
+from voiceprint import extract_voiceprint_via_api
+
+# Seuil cosinus (les similarités entre voiceprints n'ont pas l'échelle des confiances de /v1/identify)
+LOCAL_THRESHOLD = 0.50
+TOP_K = 3
+# Nombre max de voix envoyées à /v1/identify (taille de requête constante quelle que soit la base)
+MAX_CANDIDATES = 50
+PROBE_COUNT = 3
+# Durée d'extrait par cluster : assez pour un embedding stable, sous la limite de /v1/voiceprint (30 s)
+SAMPLE_SECONDS = 20.0
+MIN_TURN_SECONDS = 1.0
+HUNGARIAN_AVAILABLE = linear_sum_assignment is not None
+
+def cluster_turns(segments, max_seconds=SAMPLE_SECONDS):
+    """{cluster: [(start, end), ...]} : tours les plus longs de chaque locuteur, jusqu'à max_seconds."""
+    by_cluster = {}
+    for seg in segments:
+        by_cluster.setdefault(seg.get('speaker'), []).append((seg['start'], seg['end']))
+
+    selected = {}
+    for cluster, turns in by_cluster.items():
+        if cluster is None: continue
+        turns.sort(key=lambda t: t[1] - t[0], reverse=True)
+        picked, total = [], 0.0
+        for start, end in turns:
+            duration = end - start
+            if total >= max_seconds or (picked and duration < MIN_TURN_SECONDS): break
+            end = min(end, start + max_seconds - total)
+            picked.append((start, end))
+            total += end - start
+        selected[cluster] = sorted(picked)
+    return selected
+
+def write_cluster_samples(audio, turns_by_cluster, out_dir=VOICEPRINT_DIR):
+    """Concatène les tours de chaque cluster en un WAV court. audio : chemin ou AudioReader. Retourne {cluster: chemin}."""
+    os.makedirs(out_dir, exist_ok=True)
+    audio = AudioReader(audio) if isinstance(audio, str) else audio
+    paths = {}
+    for cluster, turns in turns_by_cluster.items():
+        parts = [audio.read(s, e) for s, e in turns]
+        path = os.path.join(out_dir, f"cluster_{cluster}_{uuid.uuid4().hex[:8]}.wav")
+        paths[cluster] = write_wav(path, np.concatenate(parts) if parts else np.zeros(0, np.float32))
+    return paths
+
+def cluster_embeddings(api_key, sample_paths, max_workers=4, progress_callback=None):
+    """
+    Un voiceprint par cluster, jobs /v1/voiceprint lancés en parallèle.
+    Retourne ({cluster: vecteur float32}, {cluster: erreur}).
+    """
+    clusters = list(sample_paths)
+    done = []
+
+    def extract(cluster):
+        try:
+            return extract_voiceprint_via_api(api_key, sample_paths[cluster], progress_callback=lambda _: None)
+        finally:
+            if os.path.exists(sample_paths[cluster]): os.remove(sample_paths[cluster])
+            done.append(cluster)
+            if progress_callback:
+                progress_callback(len(done) / len(clusters), f"Voiceprints : {len(done)}/{len(clusters)} locuteurs")
+
+    vectors, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(clusters) or 1))) as pool:
+        for cluster, (embedding, err) in zip(clusters, pool.map(extract, clusters)):
+            if embedding:
+                vectors[cluster] = np.frombuffer(base64.b64decode(embedding), dtype='<f4')
+            else:
+                errors[cluster] = err
+    return vectors, errors
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def cosine_scores(cluster_vectors, db_matrix):
+    """Matrice (clusters x voix) de similarités cosinus, calculée en un seul produit."""
+    return _normalize(np.asarray(cluster_vectors, dtype=np.float32)) @ _normalize(db_matrix.astype(np.float32)).T
+
+def _assign_greedy(scores):
+    """Meilleures paires d'abord, chaque voix au plus une fois."""
+    pairs = {}
+    used_rows, used_cols = set(), set()
+    for flat in np.argsort(scores, axis=None)[::-1]:
+        row, col = np.unravel_index(flat, scores.shape)
+        if row in used_rows or col in used_cols: continue
+        pairs[int(row)] = int(col)
+        used_rows.add(row)
+        used_cols.add(col)
+    return pairs
+
+def assign_unique(scores):
+    """Affectation un-pour-un maximisant la similarité totale (hongrois si SciPy est disponible)."""
+    if not HUNGARIAN_AVAILABLE: return _assign_greedy(scores)
+    rows, cols = linear_sum_assignment(-scores)
+    return {int(r): int(c) for r, c in zip(rows, cols)}
+
+def match_clusters(cluster_vectors, voice_db, store_dir=STORE_DIR, threshold=LOCAL_THRESHOLD, top_k=TOP_K, unique=True):
+    """
+    Compare chaque cluster à toute la base.
+    Retourne {cluster: {"match": nom ou None, "confidence": score, "candidates": [(nom, score), ...]}}.
+    unique=True : deux clusters ne peuvent pas recevoir la même personne.
+    """
+    clusters = list(cluster_vectors)
+    names, db_matrix = load_matrix(voice_db, store_dir)
+    if not clusters or not names:
+        return {c: {"match": None, "confidence": 0.0, "candidates": []} for c in clusters}
+
+    scores = cosine_scores([cluster_vectors[c] for c in clusters], db_matrix)
+    k = min(top_k, len(names))
+    top = np.argsort(-scores, axis=1)[:, :k]
+
+    if unique:
+        assignment = assign_unique(scores)
+    else:
+        assignment = {i: int(top[i, 0]) for i in range(len(clusters))}
+
+    matches = {}
+    for i, cluster in enumerate(clusters):
+        candidates = [(names[j], float(scores[i, j])) for j in top[i]]
+        col = assignment.get(i)
+        score = float(scores[i, col]) if col is not None else 0.0
+        accepted = col is not None and score >= threshold
+        matches[cluster] = {"match": names[col] if accepted else None, "confidence": score, "candidates": candidates}
+    return matches
+
+def probe_vectors(api_key, audio_path, count=PROBE_COUNT, seconds=SAMPLE_SECONDS, max_workers=4):
+    """
+    Sonde rapide de l'audio cible : `count` extraits répartis sur la durée, un voiceprint chacun.
+    Retourne une liste de vecteurs (vide si l'API échoue : la pré-sélection retombe alors sur les tags).
+    """
+    audio = AudioReader(audio_path)
+    duration = audio.duration
+    turns = {}
+    for i in range(count):
+        start = max(0.0, duration * (i + 1) / (count + 1) - seconds / 2)
+        turns[f"probe_{i}"] = [(start, min(start + seconds, duration))]
+    vectors, errors = cluster_embeddings(api_key, write_cluster_samples(audio, turns), max_workers)
+    for key, err in errors.items():
+        print(f"Sonde {key} indisponible : {err}")
+    return list(vectors.values())
+
+def tagged_voices(voice_db, tags=()):
+    """Noms des voix portant au moins un des `tags` (casse ignorée)."""
+    wanted = {t.strip().lower() for t in tags if t and t.strip()}
+    return {name for name, entry in voice_db.items()
+            if wanted & {t.lower() for t in entry.get("tags", [])}}
+
+def select_candidates(voice_db, max_candidates=MAX_CANDIDATES, tags=(), probes=None, store_dir=STORE_DIR):
+    """
+    Sous-ensemble de la base à envoyer à /v1/identify (au plus max_candidates voix).
+    Priorité aux voix portant un des `tags` (chaîne, émission...), puis classement grossier
+    par similarité cosinus avec les sondes de l'audio cible (un seul produit matriciel).
+    Les sondes sont inutiles quand les voix taguées remplissent déjà le quota.
+    """
+    if len(voice_db) <= max_candidates: return voice_db
+    tagged = tagged_voices(voice_db, tags)
+
+    names = list(voice_db)
+    score = dict.fromkeys(names, 0.0)
+    if probes:
+        names, db_matrix = load_matrix(voice_db, store_dir)
+        best = cosine_scores(probes, db_matrix).max(axis=0)
+        score = dict(zip(names, best.tolist()))
+
+    ranked = sorted(names, key=lambda n: (n not in tagged, -score[n]))
+    return {name: voice_db[name] for name in ranked[:max_candidates]}
+
+def apply_matches(segments, matches, threshold=LOCAL_THRESHOLD):
+    """Reporte le nom retenu sur les segments (champs lus par transcript.resolve_speaker)."""
+    for seg in segments:
+        info = matches.get(seg.get('speaker'))
+        if not info or not info["match"]: continue
+        seg['match'] = info["match"]
+        seg['confidence'] = info["confidence"]
+        seg['threshold'] = threshold
+    return segments
+
+def identify_locally(api_key, audio_path, segments, voice_db, store_dir=STORE_DIR,
+                     threshold=LOCAL_THRESHOLD, top_k=TOP_K, unique=True, max_workers=4, progress_callback=None):
+    """
+    Chaîne complète sur le résultat d'une diarisation : extraits par cluster, voiceprints, appariement.
+    Retourne (matches, erreur).
+    """
+    turns = cluster_turns(segments)
+    if not turns: return {}, "Aucun locuteur à identifier."
+    try:
+        sample_paths = write_cluster_samples(audio_path, turns)
+    except Exception as e:
+        return {}, f"Extraits locuteurs impossibles : {e}"
+
+    vectors, errors = cluster_embeddings(api_key, sample_paths, max_workers, progress_callback)
+    if not vectors:
+        return {}, f"Aucun voiceprint obtenu : {next(iter(errors.values()), '')}"
+    for cluster, err in errors.items():
+        print(f"Voiceprint {cluster} indisponible : {err}")
+
+    matches = match_clusters(vectors, voice_db, store_dir, threshold, top_k, unique)
+    for cluster, info in matches.items():
+        print(f"{cluster} -> {info['match']} ({info['confidence']:.2f}) candidats : {info['candidates']}")
+    apply_matches(segments, matches, threshold)
+    return matches, None
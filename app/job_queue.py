@@ -0,0 +1,93 @@
+import json
+import sqlite3
+import threading
+import time
+
+QUEUE_PATH = "jobs.sqlite"
+STATUSES = ["queued", "running", "done", "failed"]
+
+class JobQueue:
+    """
+    File de travaux persistante (SQLite) pour le traitement par lots.
+    Un travail = une URL + ses options (mode, moteur, langue cible...) ; la paire est unique,
+    une URL déjà en file avec les mêmes options n'est pas ajoutée deux fois.
+    """
+
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    stage TEXT,
+                    message TEXT,
+                    output_dir TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    UNIQUE (url, options)
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_status ON jobs(status, id)")
+
+    def add(self, url, options):
+        """Ajoute un travail ; retourne son id, ou None s'il était déjà en file."""
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (url, options, created, updated) VALUES (?, ?, ?, ?)",
+                (url, json.dumps(options, sort_keys=True), now, now))
+            return cur.lastrowid if cur.rowcount else None
+
+    def claim(self):
+        """Prend le plus ancien travail en attente et le passe à 'running' (atomique). None si la file est vide."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT * FROM jobs WHERE status='queued' ORDER BY id LIMIT 1").fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status='running', attempts=attempts+1, error=NULL, updated=? WHERE id=?",
+                        (time.time(), row["id"]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row: return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def update(self, job_id, **fields):
+        """Met à jour status / stage / message / output_dir / error."""
+        if not fields: return
+        columns = ", ".join(f"{name}=?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {columns}, updated=? WHERE id=?",
+                               (*fields.values(), time.time(), job_id))
+
+    def requeue(self, status="running"):
+        """Remet en attente les travaux d'un statut : 'running' après un arrêt brutal, 'failed' pour réessayer."""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE jobs SET status='queued', updated=? WHERE status=?",
+                                      (time.time(), status)).rowcount
+
+    def jobs(self, status=None):
+        with self._lock:
+            if status:
+                rows = self._conn.execute("SELECT * FROM jobs WHERE status=? ORDER BY id", (status,)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {**dict.fromkeys(STATUSES, 0), **{status: n for status, n in rows}}
@@ -0,0 +1,200 @@
+"""
+Cache média partagé : chaque vidéo YouTube n'est téléchargée qu'une fois (720p vidéo+audio),
+l'audio d'analyse en est extrait localement par FFmpeg (démuxage, sans réencodage).
+Les fichiers sont adressés par (id YouTube, format) ; un budget disque borne l'ensemble
+de downloads/, downloads_video/ et temp_voiceprints/ (éviction LRU).
+Une analyse en cours épingle sa vidéo (lease) : ses fichiers, dérivés compris (.16k.f32, .16k.opus),
+ne sont jamais évincés avant la fin.
+"""
+import os
+import re
+import json
+import uuid
+import subprocess
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import yt_dlp
+
+VIDEO_DIR = "downloads_video"
+AUDIO_DIR = "downloads"
+VOICEPRINT_DIR = "temp_voiceprints"
+CACHE_DIRS = [AUDIO_DIR, VIDEO_DIR, VOICEPRINT_DIR]
+
+VIDEO_FORMAT = "720p"
+VIDEO_YDL_FORMAT = 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+
+# Budget disque total (Mo), surchargeable par variable d'environnement
+CACHE_BUDGET_BYTES = int(os.environ.get("MEDIA_CACHE_BUDGET_MB", "5000")) * 1024 * 1024
+
+_YOUTUBE_ID = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/|/live/|/v/)([A-Za-z0-9_-]{11})')
+
+_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0, "evicted_files": 0, "evicted_bytes": 0}
+# Vidéos épinglées par les analyses en cours (compteur : plusieurs analyses peuvent partager une vidéo)
+_pins = Counter()
+# Un verrou par id : deux sessions demandant la même vidéo ne téléchargent / démuxent qu'une fois
+_id_locks = {}
+
+def youtube_id(youtube_url):
+    """Id YouTube extrait de l'URL sans réseau ; à défaut, via yt-dlp (métadonnées seulement)."""
+    match = _YOUTUBE_ID.search(youtube_url)
+    if match: return match.group(1)
+    if re.fullmatch(r'[A-Za-z0-9_-]{11}', youtube_url): return youtube_url
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        return ydl.extract_info(youtube_url, download=False)['id']
+
+def _id_lock(video_id):
+    with _lock:
+        return _id_locks.setdefault(video_id, threading.Lock())
+
+def pin(video_id):
+    with _lock: _pins[video_id] += 1
+
+def unpin(video_id):
+    with _lock:
+        _pins[video_id] -= 1
+        if _pins[video_id] <= 0: del _pins[video_id]
+
+@contextmanager
+def lease(video_id):
+    """Épingle les fichiers de la vidéo (source, audio, dérivés) pour la durée du bloc."""
+    pin(video_id)
+    try:
+        yield
+    finally:
+        unpin(video_id)
+
+def _file_video_id(path):
+    # <id>.<format>... : les ids YouTube ne contiennent pas de point
+    return os.path.basename(path).split(".", 1)[0]
+
+def _info_path(video_id):
+    return os.path.join(VIDEO_DIR, f"{video_id}.info.json")
+
+def _touch(path):
+    """Marque un fichier comme récemment utilisé (l'éviction se base sur mtime)."""
+    try: os.utime(path)
+    except OSError: pass
+
+def _video_info(video_id):
+    try:
+        with open(_info_path(video_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def video_title(video_id):
+    return _video_info(video_id).get('title', 'Vidéo')
+
+def video_channel(video_id):
+    """Chaîne YouTube de la vidéo en cache (None si inconnue)."""
+    return _video_info(video_id).get('channel')
+
+def _download_video(youtube_url, video_id):
+    os.makedirs(VIDEO_DIR, exist_ok=True)
+    target = os.path.join(VIDEO_DIR, f"{video_id}.{VIDEO_FORMAT}.mp4")
+    ydl_opts = {
+        'format': VIDEO_YDL_FORMAT,
+        'outtmpl': os.path.join(VIDEO_DIR, f"{video_id}.{VIDEO_FORMAT}.%(ext)s"),
+        'merge_output_format': 'mp4',
+        'quiet': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(youtube_url, download=True)
+        filename = ydl.prepare_filename(info)
+    if not os.path.exists(target) and os.path.exists(filename):
+        os.replace(filename, target)
+    with open(_info_path(video_id), 'w', encoding='utf-8') as f:
+        json.dump({"id": video_id, "title": info.get('title', 'Vidéo'), "url": youtube_url,
+                   "channel": info.get('channel') or info.get('uploader')}, f, ensure_ascii=False)
+    return target
+
+def cached_video(youtube_url):
+    """Chemin de la vidéo si elle est déjà en cache (aucun réseau si l'id est lisible dans l'URL), sinon None."""
+    target = os.path.join(VIDEO_DIR, f"{youtube_id(youtube_url)}.{VIDEO_FORMAT}.mp4")
+    if not os.path.exists(target): return None
+    _touch(target)
+    return target
+
+def get_video(youtube_url):
+    """
+    Chemin local de la vidéo 720p (téléchargée si absente).
+    Retourne (chemin, titre, cache_hit).
+    """
+    video_id = youtube_id(youtube_url)
+    target = os.path.join(VIDEO_DIR, f"{video_id}.{VIDEO_FORMAT}.mp4")
+    with _id_lock(video_id):
+        hit = os.path.exists(target)
+        if hit:
+            _touch(target)
+        else:
+            target = _download_video(youtube_url, video_id)
+            enforce_budget(protect=[target])
+    with _lock: stats["hits" if hit else "misses"] += 1
+    return target, video_title(video_id), hit
+
+def get_audio(youtube_url):
+    """
+    Piste audio de la vidéo en cache, démuxée localement (copie du flux, pas de réencodage).
+    Retourne (chemin, titre, cache_hit) ; cache_hit=True si aucun téléchargement n'a eu lieu.
+    """
+    video_path, title, hit = get_video(youtube_url)
+    video_id = youtube_id(youtube_url)
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+    # Matroska accepte tous les codecs audio (AAC comme Opus)
+    audio_path = os.path.join(AUDIO_DIR, f"{video_id}.{VIDEO_FORMAT}.mka")
+    with _id_lock(video_id):
+        if os.path.exists(audio_path):
+            _touch(audio_path)
+            return audio_path, title, hit
+
+        tmp_path = f"{audio_path}.{uuid.uuid4().hex[:8]}.part"  # unique : un autre processus peut démuxer la même vidéo
+        process = subprocess.run(
+            ['ffmpeg', '-nostdin', '-v', 'error', '-i', video_path, '-vn', '-c:a', 'copy', '-f', 'matroska', '-y', tmp_path],
+            capture_output=True, text=True)
+        if process.returncode != 0:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise RuntimeError(f"Erreur FFMPEG (extraction audio) : {process.stderr}")
+        os.replace(tmp_path, audio_path)
+    enforce_budget(protect=[video_path, audio_path])
+    return audio_path, title, hit
+
+def cached_files():
+    """(chemin, taille, mtime) de tous les fichiers sous budget, du moins récemment utilisé au plus récent."""
+    files = []
+    for directory in CACHE_DIRS:
+        if not os.path.isdir(directory): continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and not name.endswith(".info.json"):
+                stat = os.stat(path)
+                files.append((path, stat.st_size, stat.st_mtime))
+    return sorted(files, key=lambda f: f[2])
+
+def enforce_budget(budget_bytes=None, protect=()):
+    """
+    Évince les fichiers les moins récemment utilisés jusqu'à repasser sous le budget.
+    Jamais : les chemins `protect`, les fichiers en cours d'écriture, ceux des vidéos épinglées (lease).
+    """
+    budget_bytes = CACHE_BUDGET_BYTES if budget_bytes is None else budget_bytes
+    protect = {os.path.abspath(p) for p in protect}
+    with _lock:
+        files = cached_files()
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if total <= budget_bytes: break
+            if os.path.abspath(path) in protect or path.endswith(".part") or ".part." in path: continue
+            if _file_video_id(path) in _pins: continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            stats["evicted_files"] += 1
+            stats["evicted_bytes"] += size
+        return total
+
+def cache_usage():
+    files = cached_files()
+    return {"files": len(files), "bytes": sum(size for _, size, _ in files), "budget_bytes": CACHE_BUDGET_BYTES, **stats}
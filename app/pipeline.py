@@ -0,0 +1,389 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from diarization import upload_compact_to_pyannote, start_identification_job, start_diarization_job, wait_for_result
+from transcript import prepare_audio, transcribe_words, align_transcript, stream_segments
+from translate import translate_stream
+from media_cache import get_audio, youtube_id, video_channel, video_title, pin, unpin
+from artifacts import artifact_key, secret_fingerprint, load_artifact, save_artifact
+from identification import (identify_locally, probe_vectors, select_candidates, tagged_voices,
+                            LOCAL_THRESHOLD, TOP_K, MAX_CANDIDATES, PROBE_COUNT, SAMPLE_SECONDS)
+
+# Exécuteur partagé par toutes les sessions : une analyse occupe un thread.
+ANALYSIS_WORKERS = 8
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+# La pré-transcription Whisper (mode passe complète) a son propre pool, de même taille :
+# une analyse qui l'attend ne doit jamais occuper le thread dont elle a besoin (interblocage à 8 analyses).
+_prepass_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="prepass")
+
+STAGES = [
+    ("download", "📥 Téléchargement de l'audio"),
+    ("upload", "📦 Upload vers Pyannote"),
+    ("pyannote", "👤 Analyse Pyannote"),
+    ("transcript", "📝 Transcription"),
+    ("translation", "🌍 Traduction"),
+]
+
+class AnalysisError(Exception):
+    """Erreur attendue du pipeline (message affiché tel quel)."""
+
+def download_audio(youtube_url):
+    """Audio d'analyse via le cache média partagé. Retourne (chemin, titre, cache_hit) ou (None, erreur, False)."""
+    try:
+        return get_audio(youtube_url)
+    except Exception as e: return None, str(e), False
+
+class AnalysisRun:
+    """
+    État d'une analyse exécutée en arrière-plan.
+    Le thread de travail écrit, le script Streamlit relit à chaque rerun (aucun appel st.* ici).
+    """
+
+    def __init__(self):
+        self.stages = {name: {"label": label, "status": "pending", "progress": 0.0, "message": ""} for name, label in STAGES}
+        self.result = None
+        # Répliques déjà traduites, affichées pendant l'analyse (la liste grandit au fil de l'eau)
+        self.partial = []
+        # Langue source : imposée par l'utilisateur, sinon celle détectée par Whisper
+        self.language = None
+        self.error = None
+        self.future = None
+        self.started = time.time()
+
+    def set(self, stage, status=None, progress=None, message=None):
+        info = self.stages[stage]
+        if status: info["status"] = status
+        if progress is not None: info["progress"] = progress
+        if message: info["message"] = message
+
+    def cache_hit(self, *stages, message="cache"):
+        """Étapes reprises depuis leur point de sauvegarde (aucun calcul)."""
+        for stage in stages:
+            self.set(stage, "cached", 1.0, message)
+
+    def callback(self, stage):
+        """progress_callback(fraction, message) à passer aux fonctions de transcription / traduction."""
+        return lambda fraction=None, message=None: self.set(stage, progress=fraction, message=message)
+
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+
+@contextmanager
+def _gate(params, stage):
+    """
+    Créneau de l'étape : params["stage_limits"][stage] est un sémaphore partagé par les analyses
+    concurrentes (CLI batch) ; sans limite, l'étape démarre immédiatement.
+    """
+    gate = params.get("stage_limits", {}).get(stage)
+    if gate is None:
+        yield
+        return
+    with gate:
+        yield
+
+# Groupes transcrits d'avance au plus : au-delà, Whisper attend que la traduction rattrape
+STREAM_QUEUE = 8
+# Taille des groupes quand le transcript arrive d'un bloc (passe complète, point de reprise)
+STREAM_GROUP = 20
+
+def _chunks(records, size=STREAM_GROUP):
+    for i in range(0, len(records), size):
+        yield records[i:i + size]
+
+def _buffered(iterable, maxsize=STREAM_QUEUE, tick=0.2):
+    """
+    Fait tourner le générateur `iterable` dans son propre thread, relié au consommateur par une file bornée :
+    le producteur prend jusqu'à `maxsize` éléments d'avance puis attend.
+    Rend None après `tick` s sans nouvel élément (battement pour le consommateur) ;
+    une exception du producteur est relevée chez le consommateur.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=tick)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item): return
+            put(end)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=produce, name="stream", daemon=True).start()
+    try:
+        while True:
+            try:
+                item = items.get(timeout=tick)
+            except queue.Empty:
+                yield None
+                continue
+            if item is end: return
+            if isinstance(item, Exception): raise item
+            yield item
+    finally:
+        stop.set()
+
+def _prepass_words(run, audio_path, params):
+    """Passe Whisper complète (mots horodatés), lancée pendant que Pyannote travaille."""
+    with _gate(params, "transcript"):
+        audio, language = prepare_audio(audio_path, params["whisper_model"], params.get("language"),
+                                        params.get("per_segment_language", False))
+        run.language = language
+        run.set("transcript", message=f"Passe Whisper complète en parallèle de Pyannote (langue : {language or 'auto'})...")
+        return transcribe_words(audio, params["whisper_model"], language=language)
+
+def _prepare_ahead(run, audio_path, params):
+    """Conversion PCM et détection de langue, lancées pendant que Pyannote travaille (moteurs par fenêtres / segments)."""
+    with _gate(params, "transcript"):
+        audio, language = prepare_audio(audio_path, params["whisper_model"], params.get("language"),
+                                        params.get("per_segment_language", False))
+    run.set("transcript", message=f"Audio prêt (langue : {language or 'auto'}), en attente de la diarisation...")
+    return audio, language
+
+def _transcript_stream(run, params, video_id, transcript_key, segments, audio_path, file_path, words_future=None,
+                       failed=None, prepared_future=None):
+    """
+    Étape transcription en générateur : rend les répliques groupe par groupe (fenêtres Whisper,
+    ou tranches de la passe complète), puis sauvegarde le point de reprise une fois tout transcrit.
+    audio_path : piste audio locale de l'étape upload, sinon le fichier téléchargé `file_path`.
+    failed : reçoit les fenêtres en échec ; s'il y en a, rien n'est sauvegardé (la relance les refera).
+    prepared_future : (audio, langue) de _prepare_ahead ; en cas d'échec, la préparation est refaite ici.
+    La langue retenue est notée dans run.language et sauvegardée avec le transcript.
+    """
+    failed = [] if failed is None else failed
+    transcript = []
+    detected = {}
+    prepared = None
+    if prepared_future:
+        # Résolu avant de prendre le créneau : la préparation a elle-même besoin du créneau transcription
+        try:
+            prepared = prepared_future.result()
+        except Exception as e:
+            print(f"Préparation anticipée de l'audio en échec : {e}")
+    with (nullcontext() if words_future else _gate(params, "transcript")):
+        audio_path = audio_path or file_path
+        if words_future:
+            groups = _chunks(align_transcript(words_future.result(), segments))
+        else:
+            groups = stream_segments(
+                audio_path, segments, params["whisper_model"],
+                engine=params["engine"],
+                workers=params.get("workers", 1),
+                torch_threads=params.get("torch_threads"),
+                language=params.get("language"),
+                per_segment_language=params.get("per_segment_language", False),
+                model_config=params.get("model_config"),
+                progress_callback=run.callback("transcript"),
+                failed=failed,
+                detected=detected,
+                prepared=prepared
+            )
+        for group in groups:
+            transcript.extend(group)
+            yield group
+    if "language" in detected: run.language = detected["language"]
+    if failed:
+        run.set("transcript", "done", 1.0, f"{len(transcript)} répliques, {len(failed)} fenêtres en échec (non sauvegardé)")
+        return
+    save_artifact(video_id, "transcript", transcript_key, transcript)
+    save_artifact(video_id, "language", transcript_key, run.language)
+    run.set("transcript", "done", 1.0, f"{len(transcript)} répliques")
+
+def _probe_vectors(video_id, api_key, audio_path):
+    """Sondes de l'audio (PROBE_COUNT voiceprints), calculées une fois par vidéo puis relues depuis les artefacts."""
+    probes_key = artifact_key("probes", count=PROBE_COUNT, seconds=SAMPLE_SECONDS)
+    cached = load_artifact(video_id, "probes", probes_key)
+    if cached: return [np.asarray(vector, dtype=np.float32) for vector in cached]
+    vectors = probe_vectors(api_key, audio_path)
+    # Sondes incomplètes (API en échec) : utilisées cette fois, recalculées à la prochaine analyse
+    if len(vectors) == PROBE_COUNT:
+        save_artifact(video_id, "probes", probes_key, [vector.tolist() for vector in vectors])
+    return vectors
+
+def _preselect_candidates(run, video_id, api_key, audio_path, params):
+    """Limite les voix envoyées à /v1/identify : tags (chaîne de la vidéo + roster saisi), puis sonde de l'audio."""
+    voice_db = params["voice_db"]
+    max_candidates = params.get("max_candidates", MAX_CANDIDATES)
+    if len(voice_db) <= max_candidates: return voice_db
+
+    tags = list(params.get("roster_tags", []))
+    tags.append(video_channel(youtube_id(params["url"])))
+    probes = None
+    if len(tagged_voices(voice_db, tags)) < max_candidates:
+        run.set("pyannote", message="Pré-sélection des voix (sonde de l'audio)...")
+        probes = _probe_vectors(video_id, api_key, audio_path)
+    candidates = select_candidates(voice_db, max_candidates, tags, probes)
+    run.set("pyannote", message=f"{len(candidates)}/{len(voice_db)} voix candidates")
+    return candidates
+
+# Un media:// Pyannote n'est conservé que temporairement côté API
+MEDIA_TTL = 24 * 60 * 60
+
+def _segments_params(params):
+    """Paramètres dont dépend le résultat Pyannote (une voix ré-enrôlée change d'offset, donc de clé)."""
+    mode = params["mode"]
+    keyed = {"mode": mode}
+    if mode != "diarization":
+        keyed["voices"] = sorted((name, entry.get("offset")) for name, entry in params["voice_db"].items())
+    if mode == "identification":
+        keyed.update(max_candidates=params.get("max_candidates", MAX_CANDIDATES), roster=sorted(params.get("roster_tags", [])))
+    if mode == "local":
+        keyed.update(threshold=params.get("local_threshold", LOCAL_THRESHOLD), top_k=params.get("top_k", TOP_K),
+                     unique=params.get("unique_match", True))
+    return keyed
+
+def _transcript_params(params):
+    config = params.get("model_config") or {}
+    return {"engine": params["engine"], "model_size": config.get("model_size"), "quantize": config.get("quantize"),
+            "language": params.get("language"), "per_segment_language": params.get("per_segment_language", False)}
+
+def _run_analysis(run, params):
+    api_key = params["api_key"]
+    video_id = None
+    try:
+        # 0. Clés des étapes : chacune dépend de la précédente, un paramètre modifié invalide la suite
+        video_id = youtube_id(params["url"])
+        # Les fichiers de la vidéo (audio, PCM, compact) ne peuvent pas être évincés pendant l'analyse
+        pin(video_id)
+        upload_key = artifact_key("upload", secret_fingerprint(api_key))
+        segments_key = artifact_key("segments", **_segments_params(params))
+        transcript_key = artifact_key("transcript", segments_key, **_transcript_params(params))
+        translation_key = artifact_key("translation", transcript_key, target_lang=params["target_lang"])
+
+        final_transcript = load_artifact(video_id, "translation", translation_key)
+        transcript = final_transcript or load_artifact(video_id, "transcript", transcript_key)
+        segments = transcript or load_artifact(video_id, "segments", segments_key)
+        if segments: run.cache_hit("download", "upload", "pyannote")
+        if transcript:
+            run.cache_hit("transcript")
+            run.language = load_artifact(video_id, "language", transcript_key)
+        if final_transcript: run.cache_hit("translation")
+
+        audio_path, words_future, prepared_future = None, None, None
+        if not transcript:
+            # 1. Download
+            run.set("download", "running")
+            with _gate(params, "download"):
+                file_path, title, hit = download_audio(params["url"])
+                if not file_path: raise AnalysisError(f"Téléchargement impossible : {title}")
+            run.set("download", "done", 1.0, "cache (aucun transfert)" if hit else "téléchargé")
+
+        if not segments:
+            # 2. Upload compact (Opus, la piste téléchargée reste la source de Whisper) ; un media:// récent est réutilisé
+            run.set("upload", "running")
+            upload = load_artifact(video_id, "upload", upload_key, max_age=MEDIA_TTL)
+            if upload and os.path.exists(upload["audio_path"]):
+                run.cache_hit("upload", message=f"{upload['media_name']} réutilisé")
+            else:
+                with _gate(params, "upload"):
+                    upload, err = upload_compact_to_pyannote(api_key, file_path)
+                    if err: raise AnalysisError(err)
+                save_artifact(video_id, "upload", upload_key, upload)
+                saved_mb = (upload["original_bytes"] - upload["uploaded_bytes"]) / 1e6
+                run.set("upload", "done", 1.0, f"{upload['uploaded_bytes'] / 1e6:.1f} Mo ({saved_mb:.1f} Mo économisés)")
+            audio_path = upload["audio_path"]
+
+            # 3. Lancement du job Pyannote (Identification OU Diarization ; l'identification locale part d'une diarisation)
+            run.set("pyannote", "running", message=params["mode"])
+            with _gate(params, "pyannote"):
+                if params["mode"] == "identification":
+                    candidates = _preselect_candidates(run, video_id, api_key, audio_path, params)
+                    job_id, err = start_identification_job(api_key, upload["media_name"], candidates)
+                else:
+                    job_id, err = start_diarization_job(api_key, upload["media_name"])
+                if err: raise AnalysisError(err)
+
+                # 4. Whisper démarre localement pendant que le job distant tourne : passe complète horodatée
+                # (alignée ensuite sur la diarisation), sinon conversion PCM + détection de langue
+                run.set("transcript", "running")
+                if params["engine"] == "full":
+                    words_future = _prepass_executor.submit(_prepass_words, run, audio_path, params)
+                else:
+                    prepared_future = _prepass_executor.submit(_prepare_ahead, run, audio_path, params)
+
+                pyannote_res = wait_for_result(api_key, job_id)
+                if "error" in pyannote_res: raise AnalysisError(pyannote_res["error"])
+                segments = pyannote_res.get("segments", [])
+                if not segments: raise AnalysisError("Aucun segment vocal détecté.")
+                if params["mode"] == "local":
+                    run.set("pyannote", message="Identification locale des locuteurs...")
+                    matches, err = identify_locally(
+                        api_key, audio_path, segments, params["voice_db"],
+                        threshold=params.get("local_threshold", LOCAL_THRESHOLD), top_k=params.get("top_k", TOP_K),
+                        unique=params.get("unique_match", True), progress_callback=run.callback("pyannote")
+                    )
+                    if err: raise AnalysisError(err)
+                    named = sum(1 for info in matches.values() if info["match"])
+                    run.set("pyannote", "done", 1.0, f"{len(segments)} segments, {named}/{len(matches)} locuteurs identifiés")
+                else:
+                    run.set("pyannote", "done", 1.0, f"{len(segments)} segments")
+            save_artifact(video_id, "segments", segments_key, segments)
+
+        if not final_transcript:
+            # 5-6. Transcription et traduction en flux : chaque groupe transcrit part en traduction
+            # pendant que Whisper avance, et les répliques traduites s'affichent au fil de l'eau
+            run.set("translation", "running", message=params["target_lang"])
+            transcript_failed, translation_failed = [], []
+            if transcript:
+                groups, total = _chunks(transcript), len(transcript)
+            else:
+                run.set("transcript", "running")
+                groups = _buffered(_transcript_stream(run, params, video_id, transcript_key, segments,
+                                                      audio_path, file_path, words_future, transcript_failed,
+                                                      prepared_future))
+                total = len(segments)
+            final_transcript = run.partial
+            for group in translate_stream(
+                groups, target_lang=params["target_lang"], cache=params.get("translation_cache"),
+                max_workers=params.get("translate_workers", 4), rate=params.get("translate_rate", 5.0),
+                total=total, progress_callback=run.callback("translation"), failed=translation_failed,
+                gate=params.get("stage_limits", {}).get("translation")
+            ):
+                final_transcript.extend(group)
+            # Un résultat partiel n'est jamais sauvegardé sous la clé de l'étape : la relance réessaie
+            if transcript_failed or translation_failed:
+                run.set("translation", "done", 1.0, f"{len(final_transcript)} répliques, {len(translation_failed)} non traduites"
+                        + (", transcript incomplet" if transcript_failed else "") + " (non sauvegardé)")
+            else:
+                save_artifact(video_id, "translation", translation_key, final_transcript)
+                run.set("translation", "done", 1.0, f"{len(final_transcript)} répliques")
+
+        run.result = {"final_transcript": final_transcript, "title": video_title(video_id), "url": params["url"],
+                      "target_lang": params["target_lang"], "language": run.language or params.get("language")}
+
+    except AnalysisError as e:
+        run.error = str(e)
+    except Exception as e:
+        run.error = f"Une erreur inattendue est survenue : {e}"
+    finally:
+        if video_id: unpin(video_id)
+
+    for info in run.stages.values():
+        if info["status"] == "running": info["status"] = "error"
+
+def run_analysis(params, run=None):
+    """Version synchrone (CLI batch) : l'analyse s'exécute dans le thread appelant."""
+    run = run or AnalysisRun()
+    _run_analysis(run, params)
+    return run
+
+def start_analysis(params):
+    """Lance l'analyse sur l'exécuteur d'arrière-plan et retourne immédiatement son état."""
+    run = AnalysisRun()
+    run.future = _executor.submit(_run_analysis, run, params)
+    return run
@@ -0,0 +1,76 @@
+import sys
+import time
+import streamlit as st
+
+class ProgressReporter:
+    """
+    Suivi d'une étape longue, indépendant de l'interface.
+    update(fraction, message) : fraction peut valoir None pour un simple message.
+    interactive : les erreurs sont affichées à l'utilisateur (Streamlit) au lieu d'être propagées à l'appelant.
+    """
+    interactive = False
+
+    def update(self, fraction, message=None): pass
+    def info(self, message): self.update(None, message)
+    def error(self, message): print(message, file=sys.stderr)
+    def close(self): pass
+
+class StreamlitReporter(ProgressReporter):
+    """Barre + texte Streamlit (thread du script uniquement), créés au premier update."""
+    interactive = True
+
+    def __init__(self):
+        self.progress_bar = None
+        self.status_text = None
+
+    def update(self, fraction, message=None):
+        if self.progress_bar is None:
+            self.progress_bar = st.progress(0)
+            self.status_text = st.empty()
+        if fraction is not None: self.progress_bar.progress(min(max(fraction, 0.0), 1.0))
+        if message: self.status_text.text(message)
+
+    def info(self, message): st.caption(message)
+    def error(self, message): st.error(message)
+
+    def close(self):
+        if self.progress_bar is None: return
+        self.status_text.empty()
+        self.progress_bar.empty()
+
+class CallbackReporter(ProgressReporter):
+    """Transmet tout à progress_callback(fraction, message) (thread d'arrière-plan, pas d'appel st.*)."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def update(self, fraction, message=None): self.callback(fraction, message)
+    def error(self, message): self.callback(None, message)
+
+class LogReporter(ProgressReporter):
+    """Lignes de journal préfixées (CLI, workers) ; la progression est limitée à une ligne toutes les `interval` s."""
+
+    def __init__(self, prefix="", interval=5.0, stream=None):
+        self.prefix = prefix
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self._last = 0.0
+
+    def update(self, fraction, message=None):
+        now = time.monotonic()
+        if fraction is not None and fraction < 1.0 and now - self._last < self.interval: return
+        self._last = now
+        percent = f"{fraction * 100:3.0f}% " if fraction is not None else ""
+        print(f"{self.prefix}{percent}{message or ''}", file=self.stream, flush=True)
+
+    def error(self, message):
+        print(f"{self.prefix}ERREUR {message}", file=sys.stderr, flush=True)
+
+def get_reporter(progress=None):
+    """
+    None : barre Streamlit ; ProgressReporter : utilisé tel quel ;
+    fonction progress_callback(fraction, message) : adaptée.
+    """
+    if progress is None: return StreamlitReporter()
+    if isinstance(progress, ProgressReporter): return progress
+    return CallbackReporter(progress)
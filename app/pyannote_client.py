@@ -0,0 +1,130 @@
+import os
+import random
+import threading
+import time
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# URL de base surchargeable (ex: serveur stub local pour les tests)
+API_URL = os.environ.get("PYANNOTE_API_URL", "https://api.pyannote.ai").rstrip("/")
+
+# (connexion, lecture) en secondes
+DEFAULT_TIMEOUT = (10, 60)
+UPLOAD_TIMEOUT = (10, 600)
+
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# POST crée un job (payant) : un timeout de lecture ou un 502 peut survenir après son acceptation,
+# on ne rejoue donc que ce qui garantit qu'il n'a pas été créé
+POST_RETRY_STATUSES = {429}
+
+# Durée max d'attente d'un job (diarisation d'une vidéo longue comprise)
+JOB_DEADLINE = 60 * 60
+POLL_INTERVAL = 2
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Session partagée (keep-alive + pool de connexions) pour tous les appels Pyannote."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def api_url(path):
+    return f"{API_URL}{path}"
+
+def auth_headers(api_key, json_body=True):
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if json_body: headers["Content-Type"] = "application/json"
+    return headers
+
+def _backoff(attempt, response=None):
+    """Backoff exponentiel borné avec jitter ; respecte Retry-After si l'API le fournit."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+def is_connect_error(error):
+    """La requête n'est jamais partie (connexion refusée, DNS, timeout de connexion) : la rejouer est sans risque."""
+    if isinstance(error, requests.exceptions.ConnectTimeout): return True
+    if not isinstance(error, requests.exceptions.ConnectionError): return False
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, retries=MAX_RETRIES, body_factory=None, **kwargs):
+    """
+    Requête HTTP via la session partagée, avec timeouts et nouvelles tentatives
+    sur erreurs réseau et statuts transitoires (429, 5xx).
+    POST (création de job) : nouvelle tentative seulement sur erreur de connexion et 429,
+    jamais sur un timeout de lecture ou un 5xx (le job a pu être créé).
+    body_factory : appelé à chaque tentative pour fournir `data` (un flux de fichier ne se relit pas).
+    Lève l'exception requests si toutes les tentatives échouent.
+    """
+    idempotent = method.upper() != "POST"
+    statuses = RETRY_STATUSES if idempotent else POST_RETRY_STATUSES
+    for attempt in range(retries + 1):
+        if body_factory: kwargs["data"] = body_factory()
+        try:
+            res = get_session().request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == retries or not (idempotent or is_connect_error(e)): raise
+            time.sleep(_backoff(attempt))
+            continue
+        finally:
+            data = kwargs.get("data")
+            if body_factory and hasattr(data, "close"): data.close()
+
+        if res.status_code in statuses and attempt < retries:
+            time.sleep(_backoff(attempt, res))
+            continue
+        return res
+
+def post_json(api_key, path, payload):
+    return request("POST", api_url(path), headers=auth_headers(api_key), json=payload)
+
+def put_file(upload_url, file_path):
+    """Upload binaire (URL pré-signée) ; le fichier est rouvert à chaque tentative."""
+    return request("PUT", upload_url, timeout=UPLOAD_TIMEOUT, body_factory=lambda: open(file_path, "rb"))
+
+def get_job(api_key, job_id):
+    return request("GET", api_url(f"/v1/jobs/{job_id}"), headers=auth_headers(api_key, json_body=False))
+
+def poll_job(api_key, job_id, deadline=JOB_DEADLINE, interval=POLL_INTERVAL, progress_callback=None):
+    """
+    Attend la fin d'un job (succeeded / failed) dans la limite de `deadline` secondes.
+    progress_callback(elapsed) est appelé à chaque tour avec le temps écoulé (s).
+    Retourne (job_info, erreur).
+    """
+    start = time.monotonic()
+    while True:
+        try:
+            res = get_job(api_key, job_id)
+        except requests.exceptions.RequestException as e:
+            return None, f"Erreur connexion Job Status: {e}"
+
+        if res.status_code != 200:
+            return None, f"Erreur Job Status: {res.text}"
+
+        job_info = res.json()
+        status = job_info.get("status")
+        if status in ("succeeded", "failed"):
+            return job_info, None
+
+        elapsed = time.monotonic() - start
+        if elapsed > deadline:
+            return None, f"Timeout: le job {job_id} n'est pas terminé après {int(elapsed)} s."
+
+        if progress_callback: progress_callback(elapsed)
+        time.sleep(interval)
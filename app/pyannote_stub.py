@@ -0,0 +1,262 @@
+"""
+Serveur stub local de l'API Pyannote, pour tester pyannote_client sans compte ni réseau.
+
+Usage :
+    python app/pyannote_stub.py serve --port 8900
+    PYANNOTE_API_URL=http://127.0.0.1:8900 streamlit run app/app.py
+    python app/pyannote_stub.py check
+
+Endpoints imités : /v1/media/input (+ URL d'upload PUT, qui refuse le transfert chunked comme S3),
+/v1/diarize, /v1/identify, /v1/voiceprint, /v1/jobs/<id>.
+Pannes injectables : `faults[chemin]` = statuts renvoyés (dans l'ordre) avant de répondre normalement,
+`delays[chemin]` = secondes d'attente avant de répondre (timeout de lecture), `job_polls` = lectures
+d'un job avant qu'il ne se termine (None : jamais).
+`check` rejoue les scénarios de nouvelle tentative, de backoff et d'échéance contre le client.
+"""
+import argparse
+import base64
+import json
+import socket
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import pyannote_client
+
+JOB_ENDPOINTS = {"/v1/diarize": "diarization", "/v1/identify": "identification", "/v1/voiceprint": "voiceprint"}
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.faults = {}
+        self.delays = {}
+        self.job_polls = 1
+        self.hits = {}
+        self.jobs = {}
+        self.uploads = {}
+
+    def created(self, endpoint):
+        """Jobs réellement créés sur un endpoint (un doublon = une nouvelle tentative de trop)."""
+        return sum(1 for job in self.jobs.values() if job["endpoint"] == endpoint)
+
+def _job_output(kind, payload):
+    if kind == "voiceprint":
+        return {"voiceprint": base64.b64encode(bytes(4 * 256)).decode("ascii")}
+    segments = [{"speaker": "SPEAKER_00", "start": 0.0, "end": 2.0}, {"speaker": "SPEAKER_01", "start": 2.0, "end": 4.0}]
+    if kind == "identification":
+        names = [v.get("label") for v in payload.get("voiceprints", [])] or ["SPEAKER_00"]
+        segments = [{**seg, "match": names[0], "confidence": 0.95} for seg in segments]
+    return {kind: segments}
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, *args): pass
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body or {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        try:
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client parti (timeout de lecture simulé)
+
+    def _intercept(self, path):
+        """Panne programmée pour ce chemin : délai puis statut d'erreur. True si la réponse est déjà envoyée."""
+        state = self.state
+        with state.lock:
+            state.hits[path] = state.hits.get(path, 0) + 1
+            delay = state.delays.get(path, [])
+            delay = delay.pop(0) if delay else 0
+            faults = state.faults.get(path, [])
+            status = faults.pop(0) if faults else None
+        if delay: time.sleep(delay)
+        if status is None: return False
+        self._send(status, {"error": "stub"}, {"Retry-After": "1"} if status == 429 else None)
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        payload = self._read_json()
+        if path == "/v1/media/input":
+            # Le délai / la panne s'appliquent après lecture du corps (comme une passerelle lente)
+            if self._intercept(path): return
+            key = payload.get("url", "").replace("media://", "")
+            host, port = self.server.server_address[:2]
+            return self._send(201, {"url": f"http://{host}:{port}/upload/{key}"})
+        if path in JOB_ENDPOINTS:
+            with self.state.lock:
+                faults = self.state.faults.get(path, [])
+                rate_limited = bool(faults) and faults[0] == 429
+            # 429 : refusé avant toute création (limite de débit)
+            if rate_limited and self._intercept(path): return
+            # Sinon le job est créé AVANT la panne éventuelle : un timeout ou un 502 n'empêche pas sa création
+            job_id = uuid.uuid4().hex
+            with self.state.lock:
+                self.state.jobs[job_id] = {"endpoint": path, "payload": payload, "polls": 0}
+            if self._intercept(path): return
+            return self._send(200, {"jobId": job_id})
+        self._send(404, {"error": "not found"})
+
+    def do_PUT(self):
+        path = self.path.split("?")[0]
+        if not path.startswith("/upload/"): return self._send(404, {"error": "not found"})
+        if "chunked" in (self.headers.get("Transfer-Encoding") or "").lower():
+            # Comportement des URL S3 pré-signées
+            return self._send(501, {"error": "NotImplemented: Transfer-Encoding"})
+        if self._intercept("/upload"): return
+        length = int(self.headers.get("Content-Length") or 0)
+        with self.state.lock:
+            self.state.uploads[path[len("/upload/"):]] = len(self.rfile.read(length))
+        self._send(200)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if not path.startswith("/v1/jobs/"): return self._send(404, {"error": "not found"})
+        if self._intercept("/v1/jobs"): return
+        state = self.state
+        with state.lock:
+            job = state.jobs.get(path[len("/v1/jobs/"):])
+            if job is None: return self._send(404, {"error": "unknown job"})
+            job["polls"] += 1
+            finished = state.job_polls is not None and job["polls"] > state.job_polls
+        if not finished: return self._send(200, {"status": "running"})
+        kind = JOB_ENDPOINTS[job["endpoint"]]
+        self._send(200, {"status": "succeeded", "output": _job_output(kind, job["payload"])})
+
+def serve(port=0, host="127.0.0.1"):
+    """Démarre le stub dans un thread ; retourne (serveur, état, URL de base)."""
+    state = StubState()
+    handler = type("Handler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}"
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def run_checks():
+    """Scénarios de nouvelle tentative / backoff / échéance ; retourne le nombre d'échecs."""
+    server, state, url = serve()
+    pyannote_client.API_URL = url
+    pyannote_client.BACKOFF_BASE = 0.01
+    failures = 0
+
+    def check(name, condition, detail=""):
+        nonlocal failures
+        print(f"{'OK   ' if condition else 'ECHEC'} {name}" + (f" ({detail})" if detail else ""))
+        failures += 0 if condition else 1
+
+    def reset():
+        state.faults.clear(); state.delays.clear(); state.hits.clear(); state.jobs.clear()
+        state.job_polls = 1
+
+    # GET : 5xx transitoires rejoués
+    reset()
+    job_id = pyannote_client.post_json("key", "/v1/diarize", {"url": "media://a"}).json()["jobId"]
+    state.faults["/v1/jobs"] = [503, 502]
+    res = pyannote_client.get_job("key", job_id)
+    check("GET rejoué sur 503/502", res.status_code == 200 and state.hits["/v1/jobs"] == 3, f"{state.hits['/v1/jobs']} appels")
+
+    # POST : 429 rejoué (job non créé), Retry-After respecté
+    reset()
+    state.faults["/v1/diarize"] = [429]
+    started = time.monotonic()
+    res = pyannote_client.post_json("key", "/v1/diarize", {"url": "media://a"})
+    waited = time.monotonic() - started
+    check("POST rejoué sur 429", res.status_code == 200 and state.created("/v1/diarize") == 1,
+          f"{state.created('/v1/diarize')} job(s)")
+    check("Retry-After respecté", waited >= 1.0, f"{waited:.2f} s")
+
+    # POST : 502 après création du job -> pas de nouvelle tentative (pas de job en double)
+    reset()
+    state.faults["/v1/identify"] = [502]
+    res = pyannote_client.post_json("key", "/v1/identify", {"url": "media://a", "voiceprints": []})
+    check("POST non rejoué sur 502", res.status_code == 502 and state.created("/v1/identify") == 1,
+          f"{state.hits['/v1/identify']} appel(s), {state.created('/v1/identify')} job(s)")
+
+    # POST : timeout de lecture après création -> erreur remontée, un seul job
+    reset()
+    state.delays["/v1/voiceprint"] = [1.0]
+    try:
+        pyannote_client.request("POST", f"{url}/v1/voiceprint", timeout=(2, 0.3), json={"url": "media://a"})
+        timed_out = False
+    except requests.exceptions.ReadTimeout:
+        timed_out = True
+    check("POST non rejoué sur timeout de lecture", timed_out and state.created("/v1/voiceprint") == 1,
+          f"{state.created('/v1/voiceprint')} job(s)")
+
+    # POST : connexion refusée -> rejoué (la requête n'est jamais partie), puis erreur
+    closed = f"http://127.0.0.1:{_free_port()}"
+    started = time.monotonic()
+    try:
+        pyannote_client.request("POST", f"{closed}/v1/diarize", json={})
+        refused = False
+    except requests.exceptions.ConnectionError as e:
+        refused = pyannote_client.is_connect_error(e)
+    check("POST rejoué sur connexion refusée", refused, f"{time.monotonic() - started:.2f} s de backoff")
+
+    # PUT : transfert chunked refusé (URL pré-signée), fichier complet accepté
+    reset()
+    upload_url = pyannote_client.post_json("key", "/v1/media/input", {"url": "media://b.flac"}).json()["url"]
+    res = pyannote_client.request("PUT", upload_url, retries=0, data=iter([b"abc", b"def"]))
+    check("PUT chunked refusé", res.status_code == 501)
+    state.faults["/upload"] = [503]
+    res = pyannote_client.request("PUT", upload_url, data=b"abcdef")
+    check("PUT rejoué sur 503", res.status_code == 200 and state.uploads.get("b.flac") == 6)
+
+    # Échéance : un job qui ne se termine jamais rend une erreur au lieu de boucler
+    reset()
+    state.job_polls = None
+    job_id = pyannote_client.post_json("key", "/v1/diarize", {"url": "media://a"}).json()["jobId"]
+    started = time.monotonic()
+    info, err = pyannote_client.poll_job("key", job_id, deadline=0.5, interval=0.1)
+    check("Échéance du job", info is None and err and err.startswith("Timeout"), f"{time.monotonic() - started:.2f} s")
+
+    # Job normal : terminé avec sa sortie
+    reset()
+    job_id = pyannote_client.post_json("key", "/v1/diarize", {"url": "media://a"}).json()["jobId"]
+    info, err = pyannote_client.poll_job("key", job_id, interval=0.05)
+    check("Job terminé", err is None and info["output"].get("diarization"))
+
+    server.shutdown()
+    print(f"{failures} échec(s)")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local de l'API Pyannote")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="Sert le stub (PYANNOTE_API_URL=http://127.0.0.1:<port>)")
+    p_serve.add_argument("--port", type=int, default=8900)
+    p_serve.add_argument("--job-polls", type=int, default=2, help="Lectures d'un job avant qu'il ne se termine")
+    sub.add_parser("check", help="Rejoue les scénarios de nouvelle tentative et d'échéance")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        sys.exit(1 if run_checks() else 0)
+
+    server, state, url = serve(args.port)
+    state.job_polls = args.job_polls
+    print(f"Stub Pyannote sur {url}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,83 +1,527 @@
 import whisper
-import uuid
+import bisect
 import os
+import secrets
+import time
+import uuid
+import multiprocessing
 import streamlit as st
-from pydub import AudioSegment
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.connection import Client
+from whisper.audio import SAMPLE_RATE
+from progress import get_reporter
+from audio_io import AudioReader
+
+WHISPER_SIZES = ["tiny", "base", "small", "medium", "large-v3"]
+WHISPER_DEFAULTS = {"model_size": "base", "device": "cpu", "threads": None, "quantize": False}
+
+# Serveur d'inférence partagé (whisper_server.py) : WHISPER_SERVER="hôte:port" active le mode client
+WHISPER_SERVER = os.environ.get("WHISPER_SERVER")
+# Clé d'authentification : WHISPER_SERVER_KEY si définie, sinon fichier 0600 généré au premier démarrage du serveur
+# (les messages sont dépicklés : une clé connue de tous suffirait à exécuter du code dans le serveur)
+WHISPER_SERVER_KEY_FILE = os.environ.get("WHISPER_SERVER_KEY_FILE") or os.path.join(
+    os.path.expanduser("~"), ".youtube-auto-subtitler", "whisper_server.key")
+DEFAULT_SERVER = "127.0.0.1:8765"
+# Fenêtres envoyées par requête : assez pour remplir les répliques, assez peu pour la progression et l'équité
+SERVER_CHUNK = 8
+# Passe complète via le serveur : découpée en fenêtres natives de Whisper pour ne pas monopoliser une réplique
+SERVER_SPAN_SECONDS = 30.0
 
-@st.cache_resource
-def load_whisper_model():
-    """Charge le modèle Whisper en cache (téléchargé une seule fois)."""
-    return whisper.load_model("base")
+def available_devices():
+    import torch
+    return ["cpu", "cuda"] if torch.cuda.is_available() else ["cpu"]
 
-def transcribe_segments(audio_path, segments, model):
+def quantize_whisper_model(model):
     """
-    Découpe l'audio et transcrit.
-    Logique intelligente : Identification > Diarisation simple > Inconnu
+    Quantification dynamique int8 des couches Linear (CPU uniquement).
+    Whisper utilise sa propre sous-classe de nn.Linear, que quantize_dynamic ignore :
+    on la ramène d'abord à nn.Linear (même calcul en fp32).
+    """
+    import torch
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def build_whisper_model(model_size="base", device="cpu", threads=None, quantize=False):
     """
+    Construit un modèle Whisper selon la configuration (sans cache, utilisé aussi par les workers).
+    threads : torch.set_num_threads, réglage global au processus ; à ne passer que depuis un processus
+    dédié à la transcription (worker, serveur, CLI), jamais depuis le processus Streamlit partagé.
+    """
+    import torch
+    if threads: torch.set_num_threads(threads)
+    model = whisper.load_model(model_size, device=device)
+    if quantize and device == "cpu":
+        model = quantize_whisper_model(model)
+    return model
+
+def server_key(create=False, path=WHISPER_SERVER_KEY_FILE):
+    """
+    Clé partagée serveur/clients. create=True (serveur) : génère une clé aléatoire dans un fichier
+    lisible par son seul propriétaire s'il n'existe pas encore ; les clients se contentent de la lire.
+    """
+    if os.environ.get("WHISPER_SERVER_KEY"): return os.environ["WHISPER_SERVER_KEY"].encode()
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except FileExistsError:
+            pass  # Créée entre-temps par un autre serveur : on la relit
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
     try:
-        audio = AudioSegment.from_file(audio_path)
+        with open(path) as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        raise RuntimeError(f"Clé du serveur Whisper introuvable ({path}) : démarrez whisper_server.py "
+                           "sous le même utilisateur, ou définissez WHISPER_SERVER_KEY") from None
+    if not key: raise RuntimeError(f"Clé du serveur Whisper vide : {path}")
+    return key.encode()
+
+def server_address(address=DEFAULT_SERVER):
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+class RemoteWhisper:
+    """
+    Client du serveur d'inférence partagé, utilisé à la place du modèle local (aucun poids chargé ici).
+    Les fenêtres sont envoyées par chemin PCM + bornes (l'audio ne transite pas par la socket) ;
+    quand la file du serveur est pleine, il répond "busy" et le client patiente avant de renvoyer.
+    config : configuration du modèle servi (clés de build_whisper_model).
+    """
+
+    def __init__(self, address=DEFAULT_SERVER, authkey=None):
+        self.address = server_address(address)
+        self.authkey = authkey or server_key()
+        self.config = self.stats()["model_config"]
+
+    def connect(self):
+        return Client(self.address, authkey=self.authkey)
+
+    def request(self, conn, message):
+        while True:
+            conn.send(message)
+            reply = conn.recv()
+            if reply.get("busy"):
+                time.sleep(reply.get("retry_after", 1.0))
+                continue
+            if reply.get("error"): raise RuntimeError(f"Serveur Whisper : {reply['error']}")
+            return reply
+
+    def stats(self):
+        with self.connect() as conn:
+            return self.request(conn, {"op": "stats"})
+
+    def language(self, pcm_path):
+        with self.connect() as conn:
+            message = {"op": "language", "session": uuid.uuid4().hex, "pcm_path": os.path.abspath(pcm_path)}
+            return self.request(conn, message)["language"]
+
+    def transcribe(self, conn, session, pcm_path, spans, language=None, word_timestamps=True):
+        """
+        Un résultat Whisper par span (start, end) en secondes, horodaté depuis le début du span,
+        ou {"error": message} pour un span en échec.
+        Le chemin part en absolu : le serveur ne partage pas le répertoire courant du client.
+        """
+        message = {"op": "transcribe", "session": session, "pcm_path": os.path.abspath(pcm_path), "spans": spans,
+                   "language": language, "word_timestamps": word_timestamps}
+        return self.request(conn, message)["results"]
+
+# Modèles gardés en mémoire : la configuration courante et la précédente (un changement dans la
+# barre latérale ne doit pas accumuler un modèle par combinaison essayée)
+WHISPER_CACHE_ENTRIES = 2
+
+@st.cache_resource(max_entries=WHISPER_CACHE_ENTRIES)
+def load_whisper_model(model_size="base", device="cpu", quantize=False):
+    """
+    Charge le modèle Whisper en cache, une instance par configuration (téléchargé une seule fois).
+    Pas de réglage des threads torch : le processus Streamlit est partagé par toutes les sessions
+    (les threads par processus s'appliquent aux workers de transcription).
+    Avec WHISPER_SERVER, retourne un client du serveur partagé (la configuration est alors celle du serveur).
+    """
+    if WHISPER_SERVER: return RemoteWhisper(WHISPER_SERVER)
+    return build_whisper_model(model_size, device=device, quantize=quantize)
+
+def load_audio(audio_path):
+    """
+    Convertit l'audio UNE seule fois (ffmpeg) en PCM float32 mono 16 kHz sur disque, projeté en mémoire.
+    Les segments sont lus à la demande (audio[a:b]) : la mémoire ne croît pas avec la durée de la vidéo.
+    """
+    return AudioReader(audio_path)
+
+# Seuil de confiance par défaut de l'identification ; un segment peut porter le sien ('threshold')
+MATCH_THRESHOLD = 0.90
+
+def resolve_speaker(segment):
+    """Logique intelligente : Identification > Diarisation simple > Inconnu"""
+    # 1. Récupération des données brutes
+    # En mode Diarization, 'speaker' contient déjà SPEAKER_00
+    # En mode Identification, 'match' ou 'label' contient le nom
+    candidate_name = segment.get('match') or segment.get('label')
+    cluster_id = segment.get('speaker')
+    confidence = segment.get('confidence', 0.0)
+    threshold = segment.get('threshold', MATCH_THRESHOLD)
+
+    # 2. Logique unifiée
+    if candidate_name and "SPEAKER_" not in candidate_name and confidence >= threshold:
+        return candidate_name
+    elif cluster_id:
+        # En mode diarization pure, on aura juste SPEAKER_00, SPEAKER_01
+        return cluster_id#.replace("SPEAKER_", "Locuteur ")
+    return "Inconnu"
+
+def segment_slice(audio, start_sec, end_sec):
+    """Vue zéro-copie sur l'échantillon [start, end] (en secondes)."""
+    start = max(int(start_sec * SAMPLE_RATE), 0)
+    end = min(int(end_sec * SAMPLE_RATE), len(audio))
+    return audio[start:end]
+
+def pack_segments(segments, max_window=30.0):
+    """
+    Regroupe les segments consécutifs en fenêtres <= max_window secondes.
+    Whisper complète de toute façon chaque entrée à 30 s : on remplit la fenêtre au lieu de payer du silence.
+    Un segment plus long que la fenêtre reste seul (Whisper le découpe lui-même).
+    """
+    windows = []
+    current = []
+    for segment in segments:
+        if current and segment['end'] - current[0]['start'] > max_window:
+            windows.append(current)
+            current = []
+        current.append(segment)
+    if current: windows.append(current)
+    return windows
+
+def align_words_to_segments(words, segments):
+    """
+    Attribue chaque mot (timestamps absolus) au segment qui le recouvre le plus.
+    Sans recouvrement, on prend le segment le plus proche du milieu du mot.
+    Retourne une liste de listes de mots, alignée sur `segments` (triés par début).
+    """
+    starts = [s['start'] for s in segments]
+    assigned = [[] for _ in segments]
+    if not segments: return assigned
+
+    for word in words:
+        w_start, w_end = word['start'], word['end']
+        # Dernier segment qui commence avant la fin du mot
+        idx = bisect.bisect_left(starts, w_end) - 1
+        best, best_overlap = None, 0.0
+        j = idx
+        while j >= 0:
+            seg = segments[j]
+            overlap = min(w_end, seg['end']) - max(w_start, seg['start'])
+            if overlap > best_overlap:
+                best, best_overlap = j, overlap
+            # Segments exclusifs : au-delà, plus aucun ne peut recouvrir le mot
+            if seg['end'] <= w_start: break
+            j -= 1
+
+        if best is None:
+            mid = (w_start + w_end) / 2
+            candidates = [c for c in (idx, idx + 1) if 0 <= c < len(segments)]
+            best = min(candidates, key=lambda c: min(abs(mid - segments[c]['start']), abs(mid - segments[c]['end'])))
+        assigned[best].append(word)
+
+    return assigned
+
+def words_from_result(result, offset=0.0):
+    """Extrait les mots horodatés d'un résultat Whisper (word_timestamps=True), décalés de `offset`."""
+    words = []
+    for seg in result.get('segments', []):
+        for w in seg.get('words', []):
+            words.append({"word": w['word'], "start": w['start'] + offset, "end": w['end'] + offset})
+    return words
+
+def build_records(segments, assigned_words):
+    """Construit les enregistrements {speaker,start,end,text} à partir des mots attribués."""
+    records = []
+    for segment, words in zip(segments, assigned_words):
+        text = "".join(w['word'] for w in words).strip()
+        if text:
+            records.append({
+                "speaker": resolve_speaker(segment),
+                "start": segment['start'],
+                "end": segment['end'],
+                "text": text
+            })
+    return records
+
+def detect_language(model, audio, probes=3):
+    """
+    Détecte la langue parlée UNE fois, sur quelques extraits de 30 s répartis dans le fichier
+    (probabilités moyennées), au lieu d'une détection par segment.
+    """
+    if isinstance(model, RemoteWhisper): return model.language(audio.path)
+    window = 30 * SAMPLE_RATE
+    if len(audio) <= window:
+        offsets = [0]
+    else:
+        offsets = [int((len(audio) - window) * (k + 1) / (probes + 1)) for k in range(probes)]
+
+    totals = {}
+    for offset in offsets:
+        chunk = whisper.pad_or_trim(audio[offset:offset + window])
+        mel = whisper.log_mel_spectrogram(chunk, n_mels=model.dims.n_mels).to(model.device)
+        _, probs = model.detect_language(mel)
+        for lang, p in probs.items():
+            totals[lang] = totals.get(lang, 0.0) + p
+
+    return max(totals, key=totals.get)
+
+def transcribe_window(audio, window, model, packed=True, language=None):
+    """
+    Transcrit une unité de travail (liste de segments) et renvoie ses enregistrements.
+    packed=True : une passe avec timestamps de mots, redistribués vers chaque segment.
+    packed=False : la fenêtre est un segment unique, transcrit tel quel.
+    language=None : Whisper redétecte la langue sur cette unité (contenu multilingue).
+    """
+    chunk = segment_slice(audio, window[0]['start'], window[-1]['end'])
+    if not len(chunk): return []
+    result = model.transcribe(chunk, fp16=False, word_timestamps=packed, language=language)
+    return window_records(window, result, packed)
+
+def window_records(window, result, packed=True):
+    """Enregistrements d'une unité de travail à partir de son résultat Whisper (horodaté depuis le début de la fenêtre)."""
+    if packed:
+        words = words_from_result(result, offset=window[0]['start'])
+        return build_records(window, align_words_to_segments(words, window))
+
+    text = result['text'].strip()
+    if not text: return []
+    segment = window[0]
+    return [{
+        "speaker": resolve_speaker(segment),
+        "start": segment['start'],
+        "end": segment['end'],
+        "text": text
+    }]
+
+def build_windows(segments, engine):
+    """Unités de travail : fenêtres de ~30 s (packed) ou un segment par unité."""
+    if engine == "packed":
+        return pack_segments(segments)
+    return [[segment] for segment in segments]
+
+def _record_failure(failed, window, error):
+    """Une unité en échec est signalée (journal + liste `failed`) : le transcript est alors incomplet."""
+    print(f"Erreur : {error}")
+    if failed is not None: failed.append((window[0]['start'], window[-1]['end'], str(error)))
+
+def stream_serial(audio, windows, model, packed, language=None, progress_callback=None, failed=None):
+    """
+    Boucle simple sur un seul modèle ; rend les enregistrements de chaque unité dès qu'elle est transcrite.
+    failed : liste recevant (début, fin, erreur) des unités en échec (rendues vides).
+    """
+    total = len(windows)
+
+    reporter = get_reporter(progress_callback)
+
+    for i, window in enumerate(windows):
+        try:
+            records = transcribe_window(audio, window, model, packed=packed, language=language)
+        except Exception as e:
+            _record_failure(failed, window, e)
+            records = []
+
+        reporter.update((i + 1) / total, f"Traitement : {resolve_speaker(window[0])} ({i+1}/{total})")
+        yield records
+
+    reporter.close()
+
+# --- Backend parallèle (ProcessPoolExecutor) ---
+# Chaque processus charge son propre modèle une seule fois, et projette le même fichier PCM
+# (pas de copie de l'audio par tâche ni par processus).
+_worker_state = {}
+
+def _init_worker(model_config, pcm_path):
+    _worker_state["audio"] = AudioReader(pcm_path)
+    _worker_state["model"] = build_whisper_model(**model_config)
+
+def _worker_transcribe(index, window, packed, language):
+    try:
+        return index, transcribe_window(_worker_state["audio"], window, _worker_state["model"], packed=packed, language=language), None
     except Exception as e:
-        st.error(f"Erreur chargement audio : {e}")
-        return []
+        print(f"Erreur : {e}")
+        return index, [], str(e)
 
-    full_transcript = []
-    total_segments = len(segments)
-    
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for i, segment in enumerate(segments):
-        start_ms = int(segment['start'] * 1000)
-        end_ms = int(segment['end'] * 1000)
-        
-        # --- LOGIQUE CORRIGÉE ---
-
-        # 1. Récupération des données brutes
-        # En mode Diarization, 'speaker' contient déjà SPEAKER_00
-        # En mode Identification, 'match' ou 'label' contient le nom
-        candidate_name = segment.get('match') or segment.get('label')
-        cluster_id = segment.get('speaker') 
-        confidence = segment.get('confidence', 0.0)
-        
-        # 2. Logique unifiée
-        if candidate_name and "SPEAKER_" not in candidate_name and confidence >= 0.90:
-            final_name = candidate_name
-        elif cluster_id:
-            # En mode diarization pure, on aura juste SPEAKER_00, SPEAKER_01
-            # On transforme pour que ce soit joli
-            final_name = cluster_id#.replace("SPEAKER_", "Locuteur ")
-        else:
-            final_name = "Inconnu"
+def stream_parallel(audio, windows, packed, workers, torch_threads=None, language=None, model_config=None,
+                    progress_callback=None, failed=None):
+    """
+    Répartit les unités de travail sur `workers` processus.
+    Les résultats sont rendus dans l'ordre d'origine, dès que les unités précédentes sont toutes arrivées.
+    failed : voir stream_serial.
+    """
+    if torch_threads is None:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    worker_config = {**WHISPER_DEFAULTS, **(model_config or {}), "threads": torch_threads}
+
+    results = {}
+    next_index = 0
+    total = len(windows)
+    reporter = get_reporter(progress_callback)
+
+    # "spawn" : torch ne supporte pas bien le fork une fois ses threads démarrés
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(worker_config, audio.path)) as executor:
+        futures = [executor.submit(_worker_transcribe, i, window, packed, language) for i, window in enumerate(windows)]
+        for done, future in enumerate(as_completed(futures), start=1):
+            index, records, error = future.result()
+            if error: _record_failure(failed, windows[index], error)
+            results[index] = records
+            reporter.update(done / total, f"Traitement parallèle ({workers} processus) : {done}/{total}")
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+
+    reporter.close()
+
+def stream_remote(audio, windows, model, packed, language=None, progress_callback=None, failed=None):
+    """
+    Unités de travail envoyées au serveur partagé par lots de SERVER_CHUNK (une session par appel,
+    le serveur alterne entre sessions) ; les enregistrements sont construits ici et rendus par lot.
+    failed : voir stream_serial.
+    """
+    total = len(windows)
+    session = uuid.uuid4().hex
+    reporter = get_reporter(progress_callback)
+
+    with model.connect() as conn:
+        for i in range(0, total, SERVER_CHUNK):
+            batch = windows[i:i + SERVER_CHUNK]
+            spans = [(window[0]['start'], window[-1]['end']) for window in batch]
+            results = model.transcribe(conn, session, audio.path, spans, language=language, word_timestamps=packed)
+            records = []
+            for window, result in zip(batch, results):
+                if result.get("error"):
+                    _record_failure(failed, window, result["error"])
+                    continue
+                records.extend(window_records(window, result, packed))
+            done = i + len(batch)
+            reporter.update(done / total, f"Serveur Whisper : {done}/{total}")
+            yield records
 
+    reporter.close()
 
-        
-        # Extraction et transcription
-        chunk = audio[start_ms:end_ms]
-        chunk_filename = f"temp_{uuid.uuid4()}.wav"
-        chunk.export(chunk_filename, format="wav")
-        
+def transcribe_words(audio, model, language=None):
+    """
+    Une seule passe Whisper sur tout le fichier : Whisper garde le contexte complet et renvoie les mots horodatés.
+    Via le serveur partagé, le fichier part en fenêtres de SERVER_SPAN_SECONDS (contexte limité à chaque fenêtre).
+    """
+    if isinstance(model, RemoteWhisper):
+        # Un span unique occuperait une réplique pendant toute la passe : fenêtres de ~30 s, alternées avec
+        # les autres sessions par l'ordonnanceur du serveur (les mots sont ramenés au temps du fichier)
+        starts = [i * SERVER_SPAN_SECONDS for i in range(max(1, int(-(-audio.duration // SERVER_SPAN_SECONDS))))]
+        spans = [(start, min(start + SERVER_SPAN_SECONDS, audio.duration)) for start in starts]
+        session, words = uuid.uuid4().hex, []
+        with model.connect() as conn:
+            for i in range(0, len(spans), SERVER_CHUNK):
+                batch = spans[i:i + SERVER_CHUNK]
+                for (start, _), result in zip(batch, model.transcribe(conn, session, audio.path, batch, language=language)):
+                    if result.get("error"): raise RuntimeError(result["error"])
+                    words.extend(words_from_result(result, offset=start))
+        return words
+    # Whisper calcule le spectrogramme du fichier entier : seule étape qui matérialise tout l'audio
+    result = model.transcribe(audio[:], fp16=False, word_timestamps=True, language=language)
+    return words_from_result(result)
+
+def align_transcript(words, segments):
+    """Répartit les mots d'une passe complète sur les segments Pyannote (recouvrement maximal)."""
+    ordered = sorted(segments, key=lambda s: s['start'])
+    return build_records(ordered, align_words_to_segments(words, ordered))
+
+def transcribe_full(audio, segments, model, language=None, progress_callback=None, failed=None):
+    """
+    Mode passe complète : transcription globale puis alignement sur la diarisation.
+    Évite de perdre les mots coupés aux bords des segments.
+    failed : voir stream_serial (la passe unique compte comme une seule unité).
+    """
+    reporter = get_reporter(progress_callback)
+    reporter.update(None, "Transcription du fichier complet (passe unique)...")
+    try:
+        words = transcribe_words(audio, model, language=language)
+    except Exception as e:
+        _record_failure(failed, [{"start": 0.0, "end": audio.duration}], e)
+        return []
+    finally:
+        reporter.close()
+
+    return align_transcript(words, segments)
+
+def prepare_audio(audio_path, model, language=None, per_segment_language=False):
+    """
+    Décode l'audio et fixe la langue : forcée par l'utilisateur, sinon détectée une fois sur le fichier.
+    per_segment_language=True : ancienne détection par segment (contenu réellement multilingue).
+    Retourne (audio, langue ou None).
+    """
+    audio = load_audio(audio_path)
+    if per_segment_language:
+        return audio, None
+    if not language:
         try:
-            result = model.transcribe(chunk_filename, fp16=False)
-            text = result['text'].strip()
-            
-            if text:
-                full_transcript.append({
-                    "speaker": final_name, # On utilise le nom calculé ci-dessus
-                    "start": segment['start'],
-                    "end": segment['end'],
-                    "text": text
-                })
-                
-            status_text.text(f"Traitement : {final_name} ({i+1}/{total_segments})")
-            
+            language = detect_language(model, audio)
         except Exception as e:
-            print(f"Erreur : {e}")
-        finally:
-            if os.path.exists(chunk_filename): os.remove(chunk_filename)
-            
-        progress_bar.progress((i + 1) / total_segments)
-        
-    status_text.empty()
-    progress_bar.empty()
-    
-    return full_transcript
\ No newline at end of file
+            print(f"Erreur détection langue : {e}")
+    return audio, language
+
+def stream_segments(audio_path, segments, model, engine="segment", workers=1, torch_threads=None,
+                    language=None, per_segment_language=False, model_config=None, progress_callback=None, failed=None,
+                    detected=None, prepared=None):
+    """
+    Générateur : rend les enregistrements unité par unité (fenêtre, segment ou lot du serveur), dans l'ordre,
+    dès qu'ils sont transcrits ; l'étape suivante (traduction, affichage) peut démarrer sans attendre la fin.
+    Mêmes paramètres que transcribe_segments ; "full" rend tout en une fois (passe unique).
+    failed : liste recevant (début, fin, erreur) des unités en échec ; non vide = transcript incomplet.
+    detected : dict recevant la langue retenue par prepare_audio (clé "language" ; None si par segment).
+    prepared : (audio, langue) déjà rendus par prepare_audio (préparation anticipée) ; audio_path est alors ignoré.
+    """
+    reporter = get_reporter(progress_callback)
+    try:
+        audio, language = prepared or prepare_audio(audio_path, model, language, per_segment_language)
+    except Exception as e:
+        if not reporter.interactive: raise
+        reporter.error(f"Erreur chargement audio : {e}")
+        return
+    if detected is not None: detected["language"] = language
+
+    if language and not per_segment_language:
+        reporter.info(f"Langue : {language}")
+
+    if engine == "full":
+        yield transcribe_full(audio, segments, model, language=language, progress_callback=reporter, failed=failed)
+        return
+
+    windows = build_windows(segments, engine)
+    if not windows: return
+
+    packed = engine == "packed"
+    if isinstance(model, RemoteWhisper):
+        yield from stream_remote(audio, windows, model, packed, language=language, progress_callback=reporter,
+                                 failed=failed)
+    elif workers > 1:
+        yield from stream_parallel(audio, windows, packed, workers, torch_threads=torch_threads, language=language,
+                                   model_config=model_config, progress_callback=reporter, failed=failed)
+    else:
+        yield from stream_serial(audio, windows, model, packed, language=language, progress_callback=reporter,
+                                 failed=failed)
+
+def transcribe_segments(audio_path, segments, model, engine="segment", workers=1, torch_threads=None,
+                        language=None, per_segment_language=False, model_config=None, progress_callback=None):
+    """
+    Découpe l'audio (en mémoire) et transcrit.
+    Logique intelligente : Identification > Diarisation simple > Inconnu
+    engine : "segment" (une passe par segment), "packed" (fenêtres de ~30 s)
+    ou "full" (passe unique sur le fichier, alignée par timestamps de mots).
+    model : modèle Whisper ou RemoteWhisper (serveur partagé : workers est alors ignoré).
+    workers > 1 : fenêtres/segments répartis sur plusieurs processus (sauf "full"),
+    chacun limité à `torch_threads` threads torch (par défaut : cœurs / workers)
+    et construit avec `model_config` (mêmes clés que load_whisper_model).
+    language / per_segment_language : voir prepare_audio.
+    progress_callback : ProgressReporter ou fonction (fraction, message) ; None = barre de progression st.
+    """
+    return [record for records in stream_segments(audio_path, segments, model, engine, workers, torch_threads, language,
+                                                  per_segment_language, model_config, progress_callback)
+            for record in records]
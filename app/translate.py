@@ -1,50 +1,331 @@
 from deep_translator import GoogleTranslator
+from deep_translator.exceptions import TooManyRequests
 import streamlit as st
+from progress import get_reporter
+import random
+import sqlite3
+import threading
 import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def translate_transcript(transcript, target_lang='fr'):
+# Limite de Google Translate : 5000 caractères par requête (on garde une marge)
+MAX_BATCH_CHARS = 4500
+# Le saut de ligne est conservé tel quel par le traducteur : il sert de séparateur entre segments
+SEPARATOR = "\n"
+
+CACHE_PATH = "translation_cache.sqlite"
+CACHE_MAX_ENTRIES = 200_000
+
+def normalize_text(text):
+    """Clé de cache : espaces superflus retirés (la casse et la ponctuation changent le sens, on les garde)."""
+    return " ".join(text.split())
+
+class TranslationCache:
     """
-    Traduit une liste de segments de transcription.
-    Ajoute un champ 'text_fr' (ou autre langue cible) à chaque segment.
+    Mémoire de traduction persistante (SQLite), clé = (texte normalisé, source, cible, fournisseur).
+    Éviction LRU au-delà de max_entries ; compteurs hits/misses pour la session.
     """
-    
-    # On utilise Google Translate via deep_translator (fiable et gratuit pour ce volume)
-    translator = GoogleTranslator(source='auto', target=target_lang)
-    
-    translated_transcript = []
-    total = len(transcript)
-    
-    # Barre de progression spécifique à la traduction
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for i, segment in enumerate(transcript):
-        original_text = segment['text']
-        
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    text TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    provider TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (text, source, target, provider)
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON translations(last_used)")
+
+    def get_many(self, texts, source, target, provider="google"):
+        """Retourne {texte: traduction} pour les textes déjà connus, et rafraîchit leur date d'usage."""
+        found = {}
+        now = time.time()
+        with self._lock, self._conn:
+            for text in texts:
+                key = normalize_text(text)
+                row = self._conn.execute(
+                    "SELECT translation FROM translations WHERE text=? AND source=? AND target=? AND provider=?",
+                    (key, source, target, provider)).fetchone()
+                if row:
+                    found[text] = row[0]
+                    self._conn.execute(
+                        "UPDATE translations SET last_used=? WHERE text=? AND source=? AND target=? AND provider=?",
+                        (now, key, source, target, provider))
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, translations, source, target, provider="google"):
+        """Enregistre {texte: traduction} puis évince les entrées les moins récemment utilisées."""
+        if not translations: return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+                [(normalize_text(t), source, target, provider, tr, now) for t, tr in translations.items()])
+            count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+@st.cache_resource
+def get_translation_cache():
+    """Mémoire de traduction partagée par toutes les sessions Streamlit."""
+    return TranslationCache(CACHE_PATH)
+
+def pack_batches(texts, max_chars=MAX_BATCH_CHARS):
+    """Regroupe les textes en lots dont la longueur totale (séparateurs compris) reste sous max_chars."""
+    batches = []
+    current = []
+    current_length = 0
+    for text in texts:
+        added = len(text) + (len(SEPARATOR) if current else 0)
+        if current and current_length + added > max_chars:
+            batches.append(current)
+            current = []
+            current_length = 0
+            added = len(text)
+        current.append(text)
+        current_length += added
+    if current: batches.append(current)
+    return batches
+
+class TokenBucket:
+    """Limiteur de débit partagé entre threads : `rate` requêtes/s en régime établi, rafales jusqu'à `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Un limiteur par fournisseur, partagé par toutes les traductions du processus (sessions, travaux batch) :
+# N analyses concurrentes restent à `rate` requêtes/s au total, pas N x rate
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def shared_limiter(provider, rate, capacity=None):
+    """TokenBucket du fournisseur ; le dernier débit demandé fait foi pour tout le monde."""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limiter = _limiters[provider] = TokenBucket(rate, capacity)
+        with limiter._lock:
+            limiter.rate = rate
+            limiter.capacity = capacity or max(1.0, rate)
+        return limiter
+
+def is_rate_limited(error):
+    """429 / TooManyRequests, quel que soit le client qui l'a levée."""
+    if isinstance(error, TooManyRequests): return True
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429: return True
+    return "429" in str(error) or "too many requests" in str(error).lower()
+
+def call_with_retry(fn, limiter=None, max_retries=4, base_delay=1.0):
+    """Appelle fn() sous le limiteur ; backoff exponentiel avec jitter sur les erreurs de limite de débit."""
+    for attempt in range(max_retries + 1):
+        if limiter: limiter.acquire()
         try:
-            # Traduction du texte
-            translated_text = translator.translate(original_text)
-            
-            # On copie le segment pour ne pas écraser l'original
-            new_segment = segment.copy()
-            new_segment['text_translated'] = translated_text
-            translated_transcript.append(new_segment)
-            
+            return fn()
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"Limite de débit atteinte, nouvel essai dans {delay:.1f}s")
+            time.sleep(delay)
+
+def translate_one(translator, text, limiter=None):
+    """Traduction d'un seul texte ; None en cas d'erreur (ex: limite API)."""
+    try:
+        return call_with_retry(lambda: translator.translate(text), limiter)
+    except Exception as e:
+        print(f"Erreur traduction : {e}")
+        return None
+
+def translate_batch(translator, batch, limiter=None):
+    """
+    Traduit un lot en une seule requête puis le redécoupe.
+    Si la requête échoue ou si le découpage ne retombe pas sur le même nombre de lignes,
+    on repasse segment par segment (repli individuel, comme avant).
+    """
+    if len(batch) > 1:
+        try:
+            translated = call_with_retry(lambda: translator.translate(SEPARATOR.join(batch)), limiter)
+            parts = translated.split(SEPARATOR) if translated else []
+            if len(parts) == len(batch):
+                return [p.strip() for p in parts]
+            print(f"Lot désaligné ({len(parts)}/{len(batch)}), repli segment par segment")
         except Exception as e:
-            # En cas d'erreur (ex: limite API), on garde le texte original
-            print(f"Erreur traduction segment {i}: {e}")
+            print(f"Erreur traduction lot : {e}")
+    return [translate_one(translator, text, limiter) for text in batch]
+
+def translator_factory(translator, target_lang):
+    """Fonction rendant le traducteur du thread courant : `translator` s'il est fourni, sinon un GoogleTranslator par thread."""
+    # On utilise Google Translate via deep_translator (fiable et gratuit pour ce volume)
+    local = threading.local()
+    def get_translator():
+        if translator is not None: return translator
+        if not hasattr(local, 'translator'):
+            local.translator = GoogleTranslator(source='auto', target=target_lang)
+        return local.translator
+    return get_translator
+
+def translate_transcript(transcript, target_lang='fr', translator=None, cache=None, provider="google",
+                         max_workers=4, rate=5.0, progress_callback=None, limiter=None):
+    """
+    Traduit une liste de segments de transcription.
+    Ajoute un champ 'text_translated' à chaque segment.
+    Les textes identiques ("Yes.", "Merci.") ne sont traduits qu'une fois, et les segments
+    sont envoyés par lots proches de la limite de caractères du fournisseur.
+    Les lots partent en parallèle (max_workers threads) sous le limiteur du fournisseur, partagé par tout
+    le processus (`rate` requêtes/s au total) ; limiter : TokenBucket à utiliser à la place.
+    cache : TranslationCache optionnelle ; les textes déjà connus ne touchent pas le réseau.
+    translator : objet exposant .translate(text), partagé entre threads (stub de test, client local...).
+    Par défaut, un GoogleTranslator par thread (l'objet n'est pas thread-safe).
+    progress_callback : ProgressReporter ou fonction (fraction, message) ; None = barre de progression st.
+    """
+
+    get_translator = translator_factory(translator, target_lang)
+
+    # Dédoublonnage (ordre conservé) ; les sauts de ligne internes casseraient le séparateur
+    unique_texts = list(dict.fromkeys(segment['text'].replace(SEPARATOR, ' ') for segment in transcript))
+
+    translations = cache.get_many(unique_texts, 'auto', target_lang, provider) if cache else {}
+    cache_hits = len(translations)
+    batches = pack_batches([t for t in unique_texts if t not in translations])
+    total = len(batches)
+
+    # Barre de progression spécifique à la traduction
+    reporter = get_reporter(progress_callback)
+
+    # Le limiteur remplace l'ancienne pause fixe pour éviter de spammer l'API et se faire bloquer
+    limiter = limiter or shared_limiter(provider, rate, capacity=max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(lambda b: translate_batch(get_translator(), b, limiter), batch): batch for batch in batches}
+        for done, future in enumerate(as_completed(futures), start=1):
+            batch = futures[future]
+            fresh = {text: tr for text, tr in zip(batch, future.result()) if tr is not None}
+            translations.update(fresh)
+            if cache: cache.put_many(fresh, 'auto', target_lang, provider)
+
+            # Mise à jour UI (thread principal uniquement)
+            reporter.update(done / total, f"Traduction lot {done}/{total} ({len(unique_texts)} textes uniques / {len(transcript)} segments)...")
+
+    # L'ordre de sortie est celui du transcript, quel que soit l'ordre d'arrivée des lots
+    translated_transcript = []
+    for segment in transcript:
+        # On copie le segment pour ne pas écraser l'original
+        new_segment = segment.copy()
+        text = segment['text'].replace(SEPARATOR, ' ')
+        # En cas d'erreur (ex: limite API), on garde le texte original
+        new_segment['text_translated'] = translations.get(text, f"[Erreur Traduction] {segment['text']}")
+        translated_transcript.append(new_segment)
+
+    reporter.close()
+
+    if cache:
+        reporter.info(f"Mémoire de traduction : {cache_hits}/{len(unique_texts)} textes déjà traduits")
+
+    return translated_transcript
+
+def translate_stream(groups, target_lang='fr', translator=None, cache=None, provider="google",
+                     max_workers=4, rate=5.0, total=None, progress_callback=None, failed=None, gate=None, limiter=None):
+    """
+    Version flux de translate_transcript : `groups` itère des listes de segments au fil de la transcription.
+    Chaque liste part en traduction dès réception (lots parallèles, même limiteur, même cache) et est rendue
+    traduite, dans l'ordre, dès que ses lots sont revenus : le groupe N se traduit pendant que Whisper
+    transcrit le groupe N+1.
+    Un None dans `groups` est un battement (rien de nouveau) : l'occasion de rendre les groupes prêts.
+    total : nombre de segments attendus, pour la progression.
+    failed : liste recevant les segments non traduits (gardés avec "[Erreur Traduction]" dans le flux).
+    gate : sémaphore de l'étape traduction (CLI batch), pris lot par lot et non pour tout le flux :
+    l'attente de la transcription n'occupe pas de créneau.
+    limiter : voir translate_transcript (défaut : limiteur partagé du fournisseur).
+    """
+    get_translator = translator_factory(translator, target_lang)
+    limiter = limiter or shared_limiter(provider, rate, capacity=max_workers)
+    reporter = get_reporter(progress_callback)
+    translations = {}
+    in_flight = {}
+    queued = deque()
+    stats = {"segments": 0, "texts": 0, "cache_hits": 0}
+
+    def translate(batch):
+        with gate or nullcontext():
+            fresh = {text: tr for text, tr in zip(batch, translate_batch(get_translator(), batch, limiter)) if tr is not None}
+        if cache: cache.put_many(fresh, 'auto', target_lang, provider)
+        return fresh
+
+    def finish(group, futures):
+        for future in futures:
+            translations.update(future.result())
+        translated = []
+        for segment in group:
             new_segment = segment.copy()
-            new_segment['text_translated'] = f"[Erreur Traduction] {original_text}"
-            translated_transcript.append(new_segment)
-        
-        # Mise à jour UI
-        status_text.text(f"Traduction segment {i+1}/{total}...")
-        progress_bar.progress((i + 1) / total)
-        
-        # Petite pause pour éviter de spammer l'API et se faire bloquer
-        time.sleep(0.1)
-
-    status_text.empty()
-    progress_bar.empty()
-    
-    return translated_transcript
\ No newline at end of file
+            text = segment['text'].replace(SEPARATOR, ' ')
+            if text not in translations and failed is not None: failed.append(segment)
+            new_segment['text_translated'] = translations.get(text, f"[Erreur Traduction] {segment['text']}")
+            translated.append(new_segment)
+        stats["segments"] += len(group)
+        fraction = stats["segments"] / total if total else None
+        reporter.update(fraction, f"Traduction : {stats['segments']}" + (f"/{total}" if total else "") + " segments")
+        return translated
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for group in groups:
+            if group:
+                texts = [t for t in dict.fromkeys(seg['text'].replace(SEPARATOR, ' ') for seg in group)
+                         if t not in translations and t not in in_flight]
+                if cache and texts:
+                    known = cache.get_many(texts, 'auto', target_lang, provider)
+                    translations.update(known)
+                    stats["cache_hits"] += len(known)
+                    texts = [t for t in texts if t not in known]
+                stats["texts"] += len(texts)
+                for batch in pack_batches(texts):
+                    future = executor.submit(translate, batch)
+                    in_flight.update(dict.fromkeys(batch, future))
+                futures = {in_flight[t] for t in (seg['text'].replace(SEPARATOR, ' ') for seg in group) if t in in_flight}
+                queued.append((group, futures))
+            while queued and all(f.done() for f in queued[0][1]):
+                yield finish(*queued.popleft())
+        while queued:
+            yield finish(*queued.popleft())
+
+    reporter.close()
+
+    if cache:
+        reporter.info(f"Mémoire de traduction : {stats['cache_hits']}/{stats['cache_hits'] + stats['texts']} textes déjà traduits")
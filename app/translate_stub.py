@@ -0,0 +1,214 @@
+"""
+Faux service de traduction local, pour tester translate.py sans réseau ni quota.
+
+Usage :
+    python app/translate_stub.py serve --port 8901 --latency 0.05 --rate 10
+    python app/translate_stub.py check
+
+POST /translate {"text", "target"} -> {"translation"} : chaque ligne devient "<cible>:<ligne>"
+(le séparateur de lots est conservé, comme chez Google).
+Pannes injectables : `faults` = statuts renvoyés (dans l'ordre) avant de répondre normalement,
+`latency` = (min, max) secondes d'attente par requête, `rate` = requêtes/s acceptées au-delà
+desquelles le service répond 429 (fenêtre glissante d'une seconde, None : illimité).
+`check` rejoue ordre de sortie, nouvelles tentatives sur 429 et limiteur partagé contre translate.py.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import translate
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.faults = []
+        self.latency = (0.0, 0.0)
+        self.rate = None
+        self.hits = 0
+        self.accepted = deque()
+
+    def reset(self):
+        with self.lock:
+            self.faults.clear()
+            self.latency = (0.0, 0.0)
+            self.rate = None
+            self.hits = 0
+            self.accepted.clear()
+
+    def max_per_second(self):
+        """Plus grand nombre de requêtes acceptées dans une fenêtre d'une seconde."""
+        times = sorted(self.accepted)
+        best, start = 0, 0
+        for end, t in enumerate(times):
+            while t - times[start] >= 1.0: start += 1
+            best = max(best, end - start + 1)
+        return best
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, *args): pass
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body or {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/translate": return self._send(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        state = self.state
+        with state.lock:
+            state.hits += 1
+            status = state.faults.pop(0) if state.faults else None
+            latency = random.uniform(*state.latency)
+            now = time.monotonic()
+            recent = sum(1 for t in state.accepted if now - t < 1.0)
+            if status is None and state.rate is not None and recent >= state.rate: status = 429
+            if status is None: state.accepted.append(now)
+        time.sleep(latency)
+        if status is not None:
+            return self._send(status, {"error": "stub"}, {"Retry-After": "1"} if status == 429 else None)
+        target = payload.get("target", "fr")
+        lines = payload.get("text", "").split(translate.SEPARATOR)
+        self._send(200, {"translation": translate.SEPARATOR.join(f"{target}:{line}" for line in lines)})
+
+class StubTranslator:
+    """Client du stub exposant .translate(text) comme deep_translator ; un 429 lève une HTTPError (status 429)."""
+
+    def __init__(self, url, target="fr"):
+        self.url = url
+        self.target = target
+
+    def translate(self, text):
+        res = requests.post(f"{self.url}/translate", json={"text": text, "target": self.target}, timeout=10)
+        res.raise_for_status()
+        return res.json()["translation"]
+
+def serve(port=0, host="127.0.0.1"):
+    """Démarre le stub dans un thread ; retourne (serveur, état, URL de base)."""
+    state = StubState()
+    handler = type("Handler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}"
+
+def _transcript(count, length=400):
+    # Textes longs et distincts : plusieurs lots (MAX_BATCH_CHARS), pas de dédoublonnage
+    return [{"start": i, "end": i + 1, "text": f"segment {i} " + "x" * length} for i in range(count)]
+
+def _quiet(fraction=None, message=None): pass
+
+def run_checks():
+    """Ordre, 429, limiteur partagé ; retourne le nombre d'échecs."""
+    server, state, url = serve()
+    translator = StubTranslator(url)
+    failures = 0
+
+    def check(name, condition, detail=""):
+        nonlocal failures
+        print(f"{'OK   ' if condition else 'ECHEC'} {name}" + (f" ({detail})" if detail else ""))
+        failures += 0 if condition else 1
+
+    def in_order(result, transcript):
+        return [seg["text_translated"] for seg in result] == [f"fr:{seg['text']}" for seg in transcript]
+
+    # Ordre conservé malgré des lots parallèles revenant dans le désordre
+    state.reset()
+    state.latency = (0.0, 0.08)
+    transcript = _transcript(60)
+    batches = len(translate.pack_batches([seg["text"] for seg in transcript]))
+    result = translate.translate_transcript(transcript, translator=translator, provider="stub-order",
+                                            max_workers=8, rate=100, progress_callback=_quiet)
+    check("Ordre conservé (lots parallèles)", in_order(result, transcript), f"{batches} lots, {state.hits} requêtes")
+
+    # 429 transitoires : rejoués avec backoff, rien de perdu
+    state.reset()
+    state.faults = [429, 429]
+    transcript = _transcript(20)
+    batches = len(translate.pack_batches([seg["text"] for seg in transcript]))
+    result = translate.translate_transcript(transcript, translator=translator, provider="stub-429",
+                                            max_workers=4, rate=100, progress_callback=_quiet)
+    check("429 rejoués", in_order(result, transcript) and state.hits == batches + 2,
+          f"{state.hits} requêtes pour {batches} lots")
+
+    # 429 persistant : abandon après max_retries nouvelles tentatives
+    state.reset()
+    state.faults = [429] * 10
+    try:
+        translate.call_with_retry(lambda: translator.translate("a"), max_retries=3, base_delay=0.01)
+        gave_up = False
+    except requests.HTTPError as e:
+        gave_up = translate.is_rate_limited(e)
+    check("429 persistant remonté", gave_up and state.hits == 4, f"{state.hits} tentatives")
+
+    # Flux : groupes rendus dans l'ordre, battements (None) compris
+    state.reset()
+    state.latency = (0.0, 0.05)
+    transcript = _transcript(30)
+    groups = [transcript[i:i + 5] for i in range(0, 30, 5)]
+    stream = [None if i % 2 else groups[i // 2] for i in range(2 * len(groups))]
+    failed = []
+    result = [seg for group in translate.translate_stream(iter(stream), translator=translator, provider="stub-stream",
+                                                          max_workers=4, rate=100, progress_callback=_quiet, failed=failed)
+              for seg in group]
+    check("Flux dans l'ordre", in_order(result, transcript) and not failed)
+
+    # Limiteur partagé : deux analyses concurrentes restent au débit global
+    # (avec un limiteur par appel, le pic doublerait : 2 x (débit + rafale))
+    state.reset()
+    rate, workers = 8, 4
+    runs = [_transcript(120), [{**seg, "text": "autre " + seg["text"]} for seg in _transcript(120)]]
+    results = [None, None]
+
+    def analysis(i):
+        results[i] = translate.translate_transcript(runs[i], translator=translator, provider="stub-shared",
+                                                    max_workers=workers, rate=rate, progress_callback=_quiet)
+    threads = [threading.Thread(target=analysis, args=(i,)) for i in range(2)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    peak = state.max_per_second()
+    check("Limiteur partagé entre analyses", all(in_order(results[i], runs[i]) for i in range(2)) and peak <= rate + workers,
+          f"{len(state.accepted)} requêtes, pic {peak}/s pour {rate}/s")
+
+    server.shutdown()
+    print(f"{failures} échec(s)")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux service de traduction local")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="Sert le stub (POST /translate)")
+    p_serve.add_argument("--port", type=int, default=8901)
+    p_serve.add_argument("--latency", type=float, default=0.05, help="Latence max par requête (s)")
+    p_serve.add_argument("--rate", type=float, default=None, help="Requêtes/s avant de répondre 429")
+    sub.add_parser("check", help="Rejoue les scénarios d'ordre, de 429 et de limiteur partagé")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        sys.exit(1 if run_checks() else 0)
+
+    server, state, url = serve(args.port)
+    state.latency = (0.0, args.latency)
+    state.rate = args.rate
+    print(f"Stub de traduction sur {url}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Base de voiceprints binaire.
+
+    voice_store/embeddings.f32   vecteurs float32 bruts, concaténés (lisibles par np.memmap)
+    voice_store/index.jsonl      une ligne JSON par enregistrement : nom, style, offset, dim
+
+Écriture en ajout seul : le vecteur est écrit (et fsync) AVANT sa ligne d'index, qui fait office de
+validation ; un enregistrement interrompu laisse au pire quelques octets orphelins, jamais un index faux.
+Une nouvelle ligne pour un nom existant remplace la précédente (ré-enrôlement).
+Le chargement ne lit que l'index : son coût ne dépend pas de la taille des embeddings.
+"""
+import os
+import json
+import base64
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+STORE_DIR = "voice_store"
+EMBEDDINGS_FILE = "embeddings.f32"
+INDEX_FILE = "index.jsonl"
+# Ancien format (une base JSON), migré une fois vers STORE_DIR par migrate_json
+LEGACY_JSON_PATH = "voice_database.json"
+
+_write_lock = threading.RLock()
+
+def _paths(store_dir):
+    return os.path.join(store_dir, EMBEDDINGS_FILE), os.path.join(store_dir, INDEX_FILE)
+
+def index_mtime(store_dir=STORE_DIR):
+    """Date de modification de l'index (0 si absent), utile comme clé de cache."""
+    try: return os.path.getmtime(_paths(store_dir)[1])
+    except OSError: return 0.0
+
+def load_index(store_dir=STORE_DIR):
+    """{nom: {"style", "offset", "dim", ...}} ; la dernière ligne d'un nom fait foi."""
+    _, index_path = _paths(store_dir)
+    entries = {}
+    if not os.path.exists(index_path): return entries
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # ligne tronquée par un arrêt brutal
+            entries[record["name"]] = record
+    return entries
+
+def open_embeddings(store_dir=STORE_DIR):
+    """Matrice plate float32 en lecture seule, projetée en mémoire (rien n'est lu avant usage)."""
+    emb_path, _ = _paths(store_dir)
+    if not os.path.exists(emb_path) or os.path.getsize(emb_path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    # shape explicite : des octets orphelins (écriture interrompue) ne doivent pas invalider la projection
+    return np.memmap(emb_path, dtype=np.float32, mode='r', shape=(os.path.getsize(emb_path) // 4,))
+
+def get_embedding(entry, store_dir=STORE_DIR, flat=None):
+    flat = open_embeddings(store_dir) if flat is None else flat
+    start = entry["offset"] // 4
+    return np.asarray(flat[start:start + entry["dim"]])
+
+def load_matrix(entries, store_dir=STORE_DIR):
+    """Empile les vecteurs des entrées demandées : (noms, matrice N x dim). Seules ces lignes sont lues."""
+    flat = open_embeddings(store_dir)
+    names = list(entries)
+    if not names: return names, np.zeros((0, 0), dtype=np.float32)
+    return names, np.stack([get_embedding(entries[n], store_dir, flat) for n in names])
+
+def embedding_b64(entry, store_dir=STORE_DIR):
+    """Format attendu par l'API Pyannote (base64 des float32 bruts)."""
+    return base64.b64encode(get_embedding(entry, store_dir).astype('<f4').tobytes()).decode('ascii')
+
+def append_voiceprint(name, embedding, style, store_dir=STORE_DIR, **extra):
+    """
+    Ajoute (ou remplace) une voix. `embedding` : chaîne base64 renvoyée par l'API ou vecteur numpy.
+    """
+    if isinstance(embedding, str):
+        vector = np.frombuffer(base64.b64decode(embedding), dtype='<f4')
+    else:
+        vector = np.asarray(embedding, dtype='<f4')
+
+    os.makedirs(store_dir, exist_ok=True)
+    emb_path, index_path = _paths(store_dir)
+    with _write_lock:
+        with open(emb_path, 'ab') as f:
+            offset = f.tell()
+            # Réaligne sur 4 octets après d'éventuels octets orphelins
+            if offset % 4:
+                f.write(b"\0" * (4 - offset % 4))
+                offset = f.tell()
+            f.write(vector.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        record = {"name": name, "style": style, "offset": offset, "dim": int(vector.shape[0]), **extra}
+        with open(index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    return record
+
+def migrate_json(json_path, store_dir=STORE_DIR):
+    """
+    Migration unique depuis l'ancien voice_database.json (ignorée si la base binaire existe déjà).
+    La base est construite dans un dossier temporaire ; l'index n'est mis en place qu'en dernier
+    (il sert de marque de fin) : une migration interrompue est simplement refaite au lancement suivant.
+    """
+    emb_path, index_path = _paths(store_dir)
+    with _write_lock:
+        if os.path.exists(index_path) or not os.path.exists(json_path): return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            db = json.load(f)
+        tmp_dir = tempfile.mkdtemp(prefix=".migration-", dir=os.path.dirname(os.path.abspath(store_dir)))
+        try:
+            count = 0
+            for name, data in db.items():
+                if data.get("embedding"):
+                    append_voiceprint(name, data["embedding"], data.get("style", {}), tmp_dir)
+                    count += 1
+            tmp_emb, tmp_index = _paths(tmp_dir)
+            if not os.path.exists(tmp_index): open(tmp_index, 'w').close()
+            if not os.path.exists(tmp_emb): open(tmp_emb, 'wb').close()
+            os.makedirs(store_dir, exist_ok=True)
+            # Sans index, la base n'a aucun enregistrement valide : remplacer les vecteurs ne perd rien
+            os.replace(tmp_emb, emb_path)
+            os.replace(tmp_index, index_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f"Migration : {count} voiceprints importés depuis {json_path}")
+    return count
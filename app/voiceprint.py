@@ -1,51 +1,50 @@
 import streamlit as st
-import requests
-import json
 import os
 import time
 import yt_dlp
-from pydub import AudioSegment
 from diarization import upload_to_pyannote
+from audio_io import cut_audio
+from media_cache import cached_video, VOICEPRINT_DIR
+from pyannote_client import post_json, poll_job
+from voice_store import append_voiceprint
 
-def download_and_cut_audio(youtube_url, start_sec, end_sec):
-    """Télécharge et coupe l'audio (inchangé)."""
+# Un extrait de quelques secondes : le job doit aboutir en une minute
+VOICEPRINT_DEADLINE = 60
 
-    temp_dir = "temp_voiceprints"
+def download_and_cut_audio(youtube_url, start_sec, end_sec):
+    """
+    Récupère uniquement l'extrait [start_sec, end_sec] (WAV mono 16 kHz).
+    Vidéo déjà en cache : découpe locale. Sinon : seek FFmpeg directement dans l'URL du flux audio,
+    seuls les octets de l'extrait sont téléchargés (durée proportionnelle à l'extrait, pas à la vidéo).
+    """
+    temp_dir = VOICEPRINT_DIR
     if not os.path.exists(temp_dir): os.makedirs(temp_dir)
 
     timestamp = int(time.time())
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': f'{temp_dir}/full_{timestamp}.%(ext)s',
-        'postprocessors': [{'key': 'FFmpegExtractAudio','preferredcodec': 'wav'}],
-        'quiet': True,
-    }
+    final_cut_path = f"{temp_dir}/sample_{timestamp}_{start_sec}_{end_sec}.wav"
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(youtube_url, download=True)
-            filename = ydl.prepare_filename(info)
-            full_audio_path = os.path.splitext(filename)[0] + ".wav"
+        source = cached_video(youtube_url)
+        headers = None
+        if not source:
+            with yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'quiet': True}) as ydl:
+                info = ydl.extract_info(youtube_url, download=False)
+            source = info['url']
+            headers = info.get('http_headers')
+            # Fin demandée au-delà de la vidéo : on s'arrête à sa durée
+            if info.get('duration'): end_sec = min(end_sec, info['duration'])
 
-        audio = AudioSegment.from_wav(full_audio_path)
-        start_ms = start_sec * 1000
-        end_ms = end_sec * 1000
-        if end_ms > len(audio): end_ms = len(audio)
-        
-        cut_audio = audio[start_ms:end_ms]
-        final_cut_path = f"{temp_dir}/sample_{timestamp}_{start_sec}_{end_sec}.wav"
-        cut_audio.export(final_cut_path, format="wav")
-        
-        if os.path.exists(full_audio_path): os.remove(full_audio_path)
-        return final_cut_path
+        return cut_audio(source, final_cut_path, start_sec, end_sec, http_headers=headers)
     except Exception as e:
+        print(f"Erreur extrait audio : {e}")
         return None
 
-def extract_voiceprint_via_api(api_key, file_path):
+def extract_voiceprint_via_api(api_key, file_path, progress_callback=None):
     """
     1. Upload le fichier.
     2. Lance le JOB de voiceprint.
     3. Attend le résultat (Polling).
+    progress_callback(fraction) : suivi hors Streamlit (sinon barre de progression st).
     """
     # 1. Upload
     try:
@@ -54,58 +53,36 @@ def extract_voiceprint_via_api(api_key, file_path):
     except Exception as e: return None, str(e)
 
     # 2. Lancement du Job (POST)
-    url = "https://api.pyannote.ai/v1/voiceprint"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {"url": media_name}
-
     try:
-        response = requests.post(url, headers=headers, json=data)
-        
+        response = post_json(api_key, "/v1/voiceprint", {"url": media_name})
+
         # Le job est créé (200 ou 201)
         if response.status_code in [200, 201]:
             job_data = response.json()
             job_id = job_data.get("jobId")
         else:
             return None, f"Erreur Lancement ({response.status_code}): {response.text}"
-            
+
     except Exception as e:
         return None, str(e)
 
     # 3. Attente du résultat (GET)
-    # On boucle tant que le statut n'est pas 'succeeded' ou 'failed'
-    status_url = f"https://api.pyannote.ai/v1/jobs/{job_id}"
-    
     # Barre de progression locale pour faire patienter
-    bar = st.progress(0)
-    
-    for i in range(30): 
-        try:
-            res = requests.get(status_url, headers=headers)
-            if res.status_code != 200:
-                return None, f"Erreur Status: {res.text}"
-            
-            status_data = res.json()
-            status = status_data.get("status")
-            
-            if status == "succeeded":
-                bar.progress(100)
+    update = progress_callback or st.progress(0).progress
 
-                output = status_data.get("output", {})
-                return output.get("voiceprint"), None
-                
-            elif status == "failed":
-                return None, "L'IA a échoué à extraire une voix."
-            
-        
-            bar.progress((i + 1) * 3)
-            time.sleep(2)
-            
-        except Exception as e:
-            return None, str(e)
-            
-    return None, "Timeout: Le job a pris trop de temps."
+    status_data, err = poll_job(api_key, job_id, deadline=VOICEPRINT_DEADLINE,
+                                progress_callback=lambda elapsed: update(min(elapsed / VOICEPRINT_DEADLINE, 1.0)))
+    if err:
+        return None, err
+
+    if status_data.get("status") == "succeeded":
+        update(1.0)
+        output = status_data.get("output", {})
+        return output.get("voiceprint"), None
+
+    return None, "L'IA a échoué à extraire une voix."
 
-def render_add_voiceprint_ui(db_path, api_key):
+def render_add_voiceprint_ui(store_dir, api_key):
     """Interface (inchangée mais appelle la fonction async corrigée)."""
     with st.expander("➕ Ajouter une voix (YouTube)"):
         st.caption("Extrait un voiceprint via l'API Pyannote officielle.")
@@ -114,6 +91,7 @@ def render_add_voiceprint_ui(db_path, api_key):
         new_avatar = st.selectbox("Avatar", ["👤", "🎤", "🎾", "🎸", "👨‍⚕️", "👩‍🚀", "🤖", "🦊"], index=0)
         
         youtube_url = st.text_input("URL YouTube source")
+        tags_text = st.text_input("Tags (chaîne, émission...)", help="Séparés par des virgules ; servent à pré-sélectionner les voix candidates.")
         
         col1, col2 = st.columns(2)
         with col1:
@@ -140,24 +118,12 @@ def render_add_voiceprint_ui(db_path, api_key):
                         if os.path.exists(sample_path): os.remove(sample_path)
                         
                         if embedding:
-                            # Sauvegarde
-                            if os.path.exists(db_path):
-                                with open(db_path, 'r', encoding='utf-8') as f:
-                                    db = json.load(f)
-                            else:
-                                db = {}
-                            
-                            db[new_name] = {
-                                "embedding": embedding,
-                                "style": {
-                                    "avatar": new_avatar,
-                                    "display_name": new_name,
-                                    "color": "orange"
-                                }
-                            }
-                            
-                            with open(db_path, 'w', encoding='utf-8') as f:
-                                json.dump(db, f, indent=4, ensure_ascii=False)
+                            # Sauvegarde (ajout seul dans la base binaire, sans réécrire les autres voix)
+                            append_voiceprint(new_name, embedding, {
+                                "avatar": new_avatar,
+                                "display_name": new_name,
+                                "color": "orange"
+                            }, store_dir, tags=[t.strip() for t in tags_text.split(",") if t.strip()])
                                 
                             status.update(label="Terminé !", state="complete")
                             st.success(f"✅ **{new_name}** ajouté !")
@@ -0,0 +1,321 @@
+"""
+Serveur d'inférence Whisper partagé entre les sessions Streamlit (et les workers batch).
+
+Usage :
+    python app/whisper_server.py --model small --quantize --replicas 2
+    WHISPER_SERVER=127.0.0.1:8765 streamlit run app/app.py
+    python app/whisper_server.py --stats
+
+Un seul processus possède le(s) modèle(s) : N sessions ouvertes ne chargent plus N copies.
+Les clients (transcript.RemoteWhisper) envoient des fenêtres sur une socket locale authentifiée
+(multiprocessing.connection) : chemin absolu du fichier PCM + bornes, jamais l'audio lui-même.
+Le serveur lit ces fichiers sur son propre disque : il n'écoute que sur la boucle locale (même machine).
+Clé de la socket : générée au premier démarrage dans ~/.youtube-auto-subtitler/whisper_server.key (0600),
+lue par les clients du même utilisateur ; WHISPER_SERVER_KEY ou WHISPER_SERVER_KEY_FILE la remplacent.
+L'ordonnanceur sert les sessions à tour de rôle (une longue vidéo ne bloque pas les autres),
+regroupe les fenêtres courtes d'une même session en une passe de ~30 s, et répond "busy"
+quand la file est pleine (le client patiente puis renvoie).
+"""
+import os
+import bisect
+import argparse
+import ipaddress
+import threading
+import time
+from collections import OrderedDict, deque
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+import numpy as np
+from whisper.audio import SAMPLE_RATE
+
+from audio_io import AudioReader, PCM_EXT
+from transcript import (build_whisper_model, detect_language, segment_slice, server_address,
+                        WHISPER_SIZES, DEFAULT_SERVER, server_key)
+
+MAX_PENDING = 256
+MAX_PER_SESSION = 32
+# Fenêtre native de Whisper : des fenêtres plus courtes sont de toute façon complétées à 30 s
+BATCH_SECONDS = 30.0
+BATCH_GAP = 0.5
+READER_CACHE = 16
+# Une session refusée qui ne revient pas dans ce délai (client parti) perd sa place d'attente
+WAIT_EXPIRY = 30.0
+
+class Request:
+    """Une fenêtre à transcrire (ou une détection de langue) ; le thread de la connexion attend `done`."""
+
+    def __init__(self, session, op, pcm_path, start=0.0, end=None, language=None, word_timestamps=True):
+        self.session = session
+        self.op = op
+        self.pcm_path = pcm_path
+        self.start = start
+        self.end = end
+        self.language = language
+        self.word_timestamps = word_timestamps
+        self.result = None
+        self.done = threading.Event()
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.end is not None else float("inf")
+
+    def batchable_with(self, other):
+        # Langue imposée seulement : sans elle, Whisper détecterait une seule langue pour toute la passe
+        return (self.op == other.op == "transcribe" and self.pcm_path == other.pcm_path
+                and self.language is not None and self.language == other.language)
+
+class Scheduler:
+    """
+    Une file par session, servies à tour de rôle (round-robin) ; capacité bornée (contre-pression).
+    Les sessions refusées faute de place sont admises dans l'ordre de leur premier refus : une session
+    qui renvoie sans cesse ne peut pas accaparer les places libérées.
+    next_batch regroupe les fenêtres consécutives d'une session tant qu'elles tiennent dans BATCH_SECONDS.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING, max_per_session=MAX_PER_SESSION):
+        self.max_pending = max_pending
+        self.max_per_session = max_per_session
+        self.queues = OrderedDict()
+        self.waiting = OrderedDict()
+        self.pending = 0
+        self.cond = threading.Condition()
+
+    def submit(self, requests):
+        """Met en file les requêtes d'une session ; False si la file est pleine ou si une autre session attend avant elle."""
+        with self.cond:
+            session = requests[0].session
+            now = time.monotonic()
+            for waiter, since in list(self.waiting.items()):
+                if now - since > WAIT_EXPIRY: del self.waiting[waiter]
+            queued = len(self.queues.get(session, ()))
+            fits = self.pending + len(requests) <= self.max_pending and queued + len(requests) <= self.max_per_session
+            if not fits or next(iter(self.waiting), session) != session:
+                self.waiting.setdefault(session, now)
+                return False
+            self.waiting.pop(session, None)
+            self.queues.setdefault(session, deque()).extend(requests)
+            self.pending += len(requests)
+            self.cond.notify_all()
+            return True
+
+    def next_batch(self):
+        """Bloque jusqu'à avoir du travail ; retourne les requêtes à traiter en une passe."""
+        with self.cond:
+            while not self.queues:
+                self.cond.wait()
+            session, queue = next(iter(self.queues.items()))
+            self.queues.move_to_end(session)
+            batch = [queue.popleft()]
+            total = batch[0].duration
+            while queue and batch[0].batchable_with(queue[0]) and total + BATCH_GAP + queue[0].duration <= BATCH_SECONDS:
+                total += BATCH_GAP + queue[0].duration
+                batch.append(queue.popleft())
+            if not queue: del self.queues[session]
+            self.pending -= len(batch)
+            return batch
+
+    def snapshot(self):
+        with self.cond:
+            return {"pending": self.pending, "sessions": {s: len(q) for s, q in self.queues.items()},
+                    "waiting": len(self.waiting)}
+
+def _pcm_file(path):
+    """
+    Seuls des fichiers PCM déjà convertis sont servis : le serveur ne lance jamais FFmpeg
+    sur un chemin fourni par un client.
+    """
+    if (not isinstance(path, str) or not os.path.isabs(path) or not path.endswith(PCM_EXT)
+            or not os.path.isfile(path)):
+        raise ValueError(f"fichier PCM {PCM_EXT} (chemin absolu) introuvable : {path!r}")
+    return path
+
+def is_loopback(host):
+    if host == "localhost": return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def _trim_result(result):
+    """Résultat Whisper réduit à ce qu'utilise le client (texte, segments, mots)."""
+    segments = [{"start": seg["start"], "end": seg["end"], "text": seg["text"],
+                 "words": [{"word": w["word"], "start": w["start"], "end": w["end"]} for w in seg.get("words", [])]}
+                for seg in result.get("segments", [])]
+    return {"text": result.get("text", ""), "language": result.get("language"), "segments": segments}
+
+def transcribe_batch(model, audio, batch):
+    """
+    Fenêtres courtes concaténées (séparées par BATCH_GAP s de silence) en une seule passe avec
+    timestamps de mots ; chaque mot est rendu à sa fenêtre, horodaté depuis le début de celle-ci.
+    """
+    gap = np.zeros(int(BATCH_GAP * SAMPLE_RATE), dtype=np.float32)
+    parts, offsets, position = [], [], 0
+    for request in batch:
+        chunk = segment_slice(audio, request.start, request.end)
+        offsets.append(position / SAMPLE_RATE)
+        parts.extend([chunk, gap])
+        position += len(chunk) + len(gap)
+
+    result = model.transcribe(np.concatenate(parts), fp16=False, word_timestamps=True, language=batch[0].language)
+    words = [[] for _ in batch]
+    for seg in result.get("segments", []):
+        for w in seg.get("words", []):
+            k = max(bisect.bisect_right(offsets, (w["start"] + w["end"]) / 2) - 1, 0)
+            words[k].append({"word": w["word"], "start": w["start"] - offsets[k], "end": w["end"] - offsets[k]})
+
+    results = []
+    for ws in words:
+        text = "".join(w["word"] for w in ws).strip()
+        segments = [{"start": ws[0]["start"], "end": ws[-1]["end"], "text": text, "words": ws}] if ws else []
+        results.append({"text": text, "language": result.get("language"), "segments": segments})
+    return results
+
+class WhisperServer:
+    """Répliques du modèle (un thread chacune) alimentées par le Scheduler ; un thread par connexion cliente."""
+
+    def __init__(self, model_config, replicas=1, max_pending=MAX_PENDING, max_per_session=MAX_PER_SESSION):
+        self.model_config = model_config
+        self.replicas = replicas
+        self.scheduler = Scheduler(max_pending, max_per_session)
+        self.stats = {"requests": 0, "batches": 0, "batched": 0, "rejected": 0, "errors": 0, "busy_seconds": 0.0}
+        self._lock = threading.Lock()
+        self._readers = OrderedDict()
+
+    def start(self):
+        for i in range(self.replicas):
+            print(f"Chargement de Whisper ({self.model_config['model_size']}) : réplique {i + 1}/{self.replicas}")
+            model = build_whisper_model(**self.model_config)
+            threading.Thread(target=self._replica, args=(model,), name=f"replica-{i}", daemon=True).start()
+
+    def reader(self, pcm_path):
+        """AudioReader partagé par fichier (les plus récents restent ouverts)."""
+        with self._lock:
+            reader = self._readers.pop(pcm_path, None) or AudioReader(pcm_path)
+            self._readers[pcm_path] = reader
+            while len(self._readers) > READER_CACHE:
+                self._readers.popitem(last=False)
+            return reader
+
+    def _run(self, model, batch):
+        first = batch[0]
+        audio = self.reader(first.pcm_path)
+        if first.op == "language":
+            return [{"language": detect_language(model, audio)}]
+        if len(batch) > 1:
+            return transcribe_batch(model, audio, batch)
+        chunk = segment_slice(audio, first.start, first.end)
+        if not len(chunk): return [{"text": "", "language": first.language, "segments": []}]
+        result = model.transcribe(chunk, fp16=False, word_timestamps=first.word_timestamps, language=first.language)
+        return [_trim_result(result)]
+
+    def _replica(self, model):
+        while True:
+            batch = self.scheduler.next_batch()
+            started = time.monotonic()
+            try:
+                results = self._run(model, batch)
+            except Exception as e:
+                print(f"Erreur : {e}")
+                results = [{"error": str(e)}] * len(batch)
+            with self._lock:
+                self.stats["requests"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["batched"] += len(batch) if len(batch) > 1 else 0
+                self.stats["errors"] += sum(1 for r in results if r.get("error"))
+                self.stats["busy_seconds"] += time.monotonic() - started
+            for request, result in zip(batch, results):
+                request.result = result
+                request.done.set()
+
+    def retry_after(self):
+        """Délai suggéré à un client refusé : durée moyenne d'une passe (temps pour qu'une place se libère)."""
+        with self._lock:
+            per_batch = self.stats["busy_seconds"] / self.stats["batches"] if self.stats["batches"] else 1.0
+        return min(max(per_batch / self.replicas, 0.2), 5.0)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        return {"model_config": self.model_config, "replicas": self.replicas, **self.scheduler.snapshot(), **stats}
+
+    def reply(self, message):
+        op = message.get("op")
+        if op == "stats": return self.snapshot()
+        session = message.get("session") or "anonyme"
+        if op == "language":
+            requests = [Request(session, "language", _pcm_file(message["pcm_path"]))]
+        elif op == "transcribe":
+            pcm_path = _pcm_file(message["pcm_path"])
+            requests = [Request(session, "transcribe", pcm_path, start, end, message.get("language"),
+                                message.get("word_timestamps", True)) for start, end in message["spans"]]
+        else:
+            return {"error": f"opération inconnue : {op}"}
+
+        if not requests: return {"results": []}
+        if len(requests) > self.scheduler.max_per_session:
+            return {"error": f"{len(requests)} fenêtres par requête (max {self.scheduler.max_per_session})"}
+        if not self.scheduler.submit(requests):
+            with self._lock: self.stats["rejected"] += 1
+            return {"busy": True, "retry_after": self.retry_after()}
+
+        for request in requests:
+            request.done.wait()
+        if op == "language": return requests[0].result
+        return {"results": [request.result for request in requests]}
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(self.reply(message))
+                except (KeyError, TypeError, ValueError) as e:
+                    conn.send({"error": f"requête invalide : {e}"})
+
+    def serve(self, address, authkey=None):
+        authkey = authkey or server_key(create=True)
+        self.start()
+        with Listener(address, authkey=authkey) as listener:
+            print(f"Serveur Whisper à l'écoute sur {address[0]}:{address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    print(f"Connexion refusée : {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur d'inférence Whisper partagé")
+    parser.add_argument("--address", default=os.environ.get("WHISPER_SERVER") or DEFAULT_SERVER, help="hôte:port")
+    parser.add_argument("--model", choices=WHISPER_SIZES, default="base")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--replicas", type=int, default=1, help="Copies du modèle traitant la file en parallèle")
+    parser.add_argument("--threads", type=int, default=None, help="Threads torch (défaut : cœurs / répliques)")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING, help="Fenêtres en file, toutes sessions")
+    parser.add_argument("--max-per-session", type=int, default=MAX_PER_SESSION, help="Fenêtres en file par session")
+    parser.add_argument("--stats", action="store_true", help="Affiche l'état d'un serveur en cours et quitte")
+    args = parser.parse_args()
+
+    address = server_address(args.address)
+    if not is_loopback(address[0]):
+        # Les clients envoient des chemins de fichiers : serveur et clients doivent partager le disque
+        parser.error(f"{address[0]} n'est pas une adresse locale : le serveur ne sert que les clients de la même machine")
+    if args.stats:
+        with Client(address, authkey=server_key()) as conn:
+            conn.send({"op": "stats"})
+            for key, value in conn.recv().items():
+                print(f"{key:>14} : {value}")
+        return
+
+    model_config = {"model_size": args.model, "device": args.device,
+                    "threads": args.threads or max(1, (os.cpu_count() or 1) // args.replicas),
+                    "quantize": args.quantize and args.device == "cpu"}
+    WhisperServer(model_config, args.replicas, args.max_pending, args.max_per_session).serve(address)
+
+if __name__ == "__main__":
+    main()